@@ -1,4 +1,4 @@
-from typing import Annotated, TypedDict
+from typing import Annotated, Any, TypedDict
 from langchain_core.messages import BaseMessage, AIMessage
 from langchain_core.tools import BaseTool  # pyright: ignore[reportUnknownVariableType]
 import operator
@@ -44,6 +44,10 @@ llm = init_chat_model(
     base_url=config.writer_base_url,
     api_key=config.writer_api_key,
 )
+"""
+共享的聊天模型客户端，所有图（包括写作 agent）都基于它 bind_tools，
+从而复用同一个底层 HTTP 连接池
+"""
 
 
 def route_tools(state: State) -> str:
@@ -54,24 +58,46 @@ def route_tools(state: State) -> str:
     messages = state["messages"]
     last_msg = messages[-1]
 
-    if isinstance(last_msg, AIMessage) and getattr(last_msg, "tool_calls", []):
+    if isinstance(last_msg, AIMessage) and last_msg.tool_calls:
         return "tools"
     else:
         return END
 
 
+_compiled_graphs: dict[tuple[str, ...], Any] = {}
+"""
+已编译的图，键为工具名元组，避免对同一组工具重复 bind_tools 和编译
+"""
+
+
 def build_graph(
     tools: list[BaseTool],
 ):
     """
     构建并返回特定的图对象
+
+    同一组工具只会构建一次，之后直接返回缓存的图
+    """
+    key = tuple(t.name for t in tools)
+    graph = _compiled_graphs.get(key)
+    if graph is None:
+        graph = _compile_graph(tools)
+        _compiled_graphs[key] = graph
+    return graph
+
+
+def _compile_graph(
+    tools: list[BaseTool],
+):
+    """
+    实际构建并编译图对象
     """
     graph_builder = StateGraph(State)
 
     llm_with_tools = llm.bind_tools(tools)  # pyright: ignore[reportUnknownMemberType]
 
-    def chatbot(state: State):
-        return {"messages": [llm_with_tools.invoke(state["messages"])]}
+    async def chatbot(state: State):
+        return {"messages": [await llm_with_tools.ainvoke(state["messages"])]}
 
     graph_builder.add_node("chatbot", chatbot)  # pyright: ignore[reportUnknownMemberType]
     graph_builder.add_edge(START, "chatbot")
@@ -38,10 +38,10 @@ def get_chapter_info_tool(
     """
     根据章节标题获取章节信息
     """
-    for ci in chapter_infos.chapters:
-        if ci.title == title:
-            return ci
-    return "未找到指定标题的章节信息"
+    index = chapter_infos.index_of(title)
+    if index is None:
+        return "未找到指定标题的章节信息"
+    return chapter_infos.chapters[index]
 
 
 @tool
@@ -52,11 +52,11 @@ def delete_chapter_by_title_tool(
     """
     根据章节标题删除章节信息
     """
-    for i, ci in enumerate(chapter_infos.chapters):
-        if ci.title == title:
-            del chapter_infos.chapters[i]
-            return f"已删除章节: {title}"
-    return "未找到指定标题的章节信息"
+    index = chapter_infos.index_of(title)
+    if index is None:
+        return "未找到指定标题的章节信息"
+    chapter_infos.remove(index)
+    return f"已删除章节: {title}"
 
 
 @tool
@@ -70,9 +70,8 @@ def delete_chapter_by_index_tool(
     注意索引从 0 开始，合法索引范围为 0 到 总章节数 - 1
     """
     if 0 <= index < len(chapter_infos.chapters):
-        deleted_title = chapter_infos.chapters[index].title
-        del chapter_infos.chapters[index]
-        return f"已删除章节: {deleted_title}"
+        deleted = chapter_infos.remove(index)
+        return f"已删除章节: {deleted.title}"
     else:
         return "索引超出范围"
 
@@ -88,11 +87,10 @@ def add_chapter_tool_to_end_tool(
     """
 
     # 检查标题是否已存在
-    for ci in chapter_infos.chapters:
-        if ci.title == title:
-            return "章节标题已存在，请使用不同的标题。"
+    if chapter_infos.index_of(title) is not None:
+        return "章节标题已存在，请使用不同的标题。"
 
-    chapter_infos.chapters.append(ChapterInfo(title=title, intent=intent))
+    chapter_infos.append(ChapterInfo(title=title, intent=intent))
     return f"已添加章节: {title}"
 
 
@@ -108,17 +106,14 @@ def add_chapter_tool_after_tool(
     """
 
     # 检查标题是否已存在
-    for ci in chapter_infos.chapters:
-        if ci.title == title:
-            return "章节标题已存在，请使用不同的标题。"
+    if chapter_infos.index_of(title) is not None:
+        return "章节标题已存在，请使用不同的标题。"
 
-    for i, ci in enumerate(chapter_infos.chapters):
-        if ci.title == after_title:
-            chapter_infos.chapters.insert(
-                i + 1, ChapterInfo(title=title, intent=intent)
-            )
-            return f"已添加章节: {title} 在 {after_title} 之后"
-    return "未找到指定标题的章节信息"
+    index = chapter_infos.index_of(after_title)
+    if index is None:
+        return "未找到指定标题的章节信息"
+    chapter_infos.insert(index + 1, ChapterInfo(title=title, intent=intent))
+    return f"已添加章节: {title} 在 {after_title} 之后"
 
 
 @tool
@@ -133,15 +128,14 @@ def add_chapter_tool_before_tool(
     """
 
     # 检查标题是否已存在
-    for ci in chapter_infos.chapters:
-        if ci.title == title:
-            return "章节标题已存在，请使用不同的标题。"
+    if chapter_infos.index_of(title) is not None:
+        return "章节标题已存在，请使用不同的标题。"
 
-    for i, ci in enumerate(chapter_infos.chapters):
-        if ci.title == before_title:
-            chapter_infos.chapters.insert(i, ChapterInfo(title=title, intent=intent))
-            return f"已添加章节: {title} 在 {before_title} 之前"
-    return "未找到指定标题的章节信息"
+    index = chapter_infos.index_of(before_title)
+    if index is None:
+        return "未找到指定标题的章节信息"
+    chapter_infos.insert(index, ChapterInfo(title=title, intent=intent))
+    return f"已添加章节: {title} 在 {before_title} 之前"
 
 
 @tool
@@ -153,11 +147,11 @@ def replace_chapter_intent_tool(
     """
     替换章节意图
     """
-    for ci in chapter_infos.chapters:
-        if ci.title == title:
-            ci.intent = new_intent
-            return f"已更新章节 '{title}' 的意图。"
-    return "未找到指定标题的章节信息"
+    index = chapter_infos.index_of(title)
+    if index is None:
+        return "未找到指定标题的章节信息"
+    chapter_infos.chapters[index].intent = new_intent
+    return f"已更新章节 '{title}' 的意图。"
 
 
 @tool
@@ -169,11 +163,13 @@ def replace_chapter_title_tool(
     """
     替换章节标题
     """
-    for ci in chapter_infos.chapters:
-        if ci.title == old_title:
-            ci.title = new_title
-            return f"已更新章节标题从 '{old_title}' 到 '{new_title}'。"
-    return "未找到指定标题的章节信息"
+    index = chapter_infos.index_of(old_title)
+    if index is None:
+        return "未找到指定标题的章节信息"
+    if new_title != old_title and chapter_infos.index_of(new_title) is not None:
+        return "章节标题已存在，请使用不同的标题。"
+    chapter_infos.rename(index, new_title)
+    return f"已更新章节标题从 '{old_title}' 到 '{new_title}'。"
 
 
 full_tools: list[BaseTool] = [
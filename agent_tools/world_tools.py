@@ -1,25 +1,31 @@
-import asyncio
 from enum import Enum
-from typing import Annotated
+import functools
+from typing import Annotated, TypedDict
 import uuid
 from langchain_core.tools import tool, BaseTool  # type: ignore
 from langgraph.prebuilt import InjectedState
 from pydantic import BaseModel, Field
-from world import AttributeValue, Edge, Entity, EntityType, SearchResultEntity, World
+from world import AttributeValue, Edge, Entity, EntityType, World
 
 
-class AttributeValueModel(BaseModel):
+class AttributeValueModel(TypedDict):
     """
     属性值输入
+
+    只包含两个字符串字段，使用 TypedDict 而不是 BaseModel，
+    这样工具参数解析后直接得到 dict，不必为每个属性值构造模型实例
     """
 
-    value: str = Field(description="属性的具体值。")
+    value: Annotated[str, Field(description="属性的具体值。")]
     """
     属性的具体内容
     """
-    timestamp_desc: str = Field(
-        description="描述该属性值生效时间点的自然语言，例如 '童年时', '在2024年', '当他拿起圣剑后'。"
-    )
+    timestamp_desc: Annotated[
+        str,
+        Field(
+            description="描述该属性值生效时间点的自然语言，例如 '童年时', '在2024年', '当他拿起圣剑后'。"
+        ),
+    ]
     """
     属性的生效时间点描述
     """
@@ -36,8 +42,74 @@ class EntityTypeEnum(str, Enum):
     ORGANIZATION = "组织"
 
 
+_ENUM_TO_TYPE: dict[EntityTypeEnum, EntityType] = {
+    EntityTypeEnum.PERSON: EntityType.PERSON,
+    EntityTypeEnum.PLACE: EntityType.PLACE,
+    EntityTypeEnum.ITEM: EntityType.ITEM,
+    EntityTypeEnum.ORGANIZATION: EntityType.ORGANIZATION,
+}
+"""
+EntityTypeEnum 到 EntityType 的映射
+"""
+
+_TYPE_TO_ENUM: dict[EntityType, EntityTypeEnum] = {
+    v: k for k, v in _ENUM_TO_TYPE.items()
+}
+"""
+EntityType 到 EntityTypeEnum 的映射
+"""
+
+_STR_TO_ENUM: dict[str, EntityTypeEnum] = {e.value: e for e in EntityTypeEnum}
+"""
+实体类型字符串（即搜索结果中的 type）到 EntityTypeEnum 的映射
+"""
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_uuid(s: str) -> uuid.UUID:
+    """
+    解析 UUID 字符串
+
+    agent 在一轮对话中往往会反复传入同一批 ID，因此缓存解析结果
+    """
+    return uuid.UUID(s)
+
+
+def _to_attr_value(model: AttributeValueModel) -> AttributeValue:
+    """
+    将单个属性值输入转换为图谱中的属性值
+    """
+    return AttributeValue(value=model["value"], timestamp_desc=model["timestamp_desc"])
+
+
+def _to_attr_values(
+    mapping: dict[str, list[AttributeValueModel]],
+) -> dict[str, list[AttributeValue]]:
+    """
+    将属性字典输入转换为图谱中的属性字典
+    """
+    return {
+        key: [_to_attr_value(av) for av in values] for key, values in mapping.items()
+    }
+
+
+def _to_attr_models(
+    mapping: dict[str, list[AttributeValue]],
+) -> dict[str, list[AttributeValueModel]]:
+    """
+    将图谱中的属性字典转换为输出模型
+    """
+    return {
+        key: [
+            AttributeValueModel(value=av.value, timestamp_desc=av.timestamp_desc)
+            for av in values
+        ]
+        for key, values in mapping.items()
+    }
+
+
 @tool
-def add_entity_tool(
+async def add_entity_tool(
     type: EntityTypeEnum,
     attributes: dict[str, list[AttributeValueModel]],
     world: Annotated[World, InjectedState("world")],
@@ -52,32 +124,17 @@ def add_entity_tool(
       - 注意，直接使用属性类别作为键，直接使用属性值列表作为值。不要使用"key"/"value"或者"属性类别"等多余键值。
     """
     try:
-        final_entity_type: EntityType
-        match type:
-            case EntityTypeEnum.PERSON:
-                final_entity_type = EntityType.PERSON
-            case EntityTypeEnum.PLACE:
-                final_entity_type = EntityType.PLACE
-            case EntityTypeEnum.ITEM:
-                final_entity_type = EntityType.ITEM
-            case EntityTypeEnum.ORGANIZATION:
-                final_entity_type = EntityType.ORGANIZATION
-        entity_attributes = {
-            key: [
-                AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                for av in values
-            ]
-            for key, values in attributes.items()
-        }
+        final_entity_type = _ENUM_TO_TYPE[type]
+        entity_attributes = _to_attr_values(attributes)
         new_entity = Entity(type=final_entity_type, attributes=entity_attributes)
-        asyncio.run(world.add_entity(new_entity))
+        await world.add_entity(new_entity)
         return f"成功添加实体，ID: {new_entity.id}"
     except Exception as e:
         return f"添加实体时出错: {str(e)}"
 
 
 @tool
-def add_edge_tool(
+async def add_edge_tool(
     from_entity_id: str,
     to_entity_id: str,
     attributes: dict[str, list[AttributeValueModel]],
@@ -94,26 +151,18 @@ def add_edge_tool(
       - 注意，直接使用属性类别作为键，直接使用属性值列表作为值。不要使用"key"/"value"或者"属性类别"等多余键值。
     """
     try:
-        from_entity_uuid = uuid.UUID(from_entity_id)
-        to_entity_uuid = uuid.UUID(to_entity_id)
-        edge_attributes = {
-            key: [
-                AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                for av in values
-            ]
-            for key, values in attributes.items()
-        }
+        from_entity_uuid = _parse_uuid(from_entity_id)
+        to_entity_uuid = _parse_uuid(to_entity_id)
+        edge_attributes = _to_attr_values(attributes)
         new_edge = Edge(
             attributes=edge_attributes,
             from_entity_id=from_entity_uuid,
             to_entity_id=to_entity_uuid,
         )
-        asyncio.run(
-            world.add_edge(
-                from_entity_id=from_entity_uuid,
-                to_entity_id=to_entity_uuid,
-                edge=new_edge,
-            )
+        await world.add_edge(
+            from_entity_id=from_entity_uuid,
+            to_entity_id=to_entity_uuid,
+            edge=new_edge,
         )
         return f"成功添加边，ID: {new_edge.id}"
     except Exception as e:
@@ -174,7 +223,7 @@ class SearchResultEdgeOutput(BaseModel):
 
 
 @tool
-def search_graph_tool(
+async def search_graph_tool(
     query: str,
     limit: int,
     world: Annotated[World, InjectedState("world")],
@@ -182,36 +231,27 @@ def search_graph_tool(
     """
     在世界记忆图谱中搜索相关的实体或者边
 
-    注意搜索结果不包括实体或边的属性详情，只包含 ID、类型和相关性评分，如果需要获取详情，请使用 `get_entity_tool` 或 `get_edge_tool`。
+    注意搜索结果不包括实体或边的属性详情，只包含 ID、类型和相关性评分，如果需要获取详情，请使用 `get_entities_tool` 或 `get_edges_tool` 批量获取（单个时可用 `get_entity_tool` 或 `get_edge_tool`）。
 
     - query: 搜索的自然语言描述
     - limit: 返回结果的最大数量
     """
     try:
-        results = asyncio.run(world.search(query, limit=limit))
+        results = await world.search(query, limit=limit)
 
         if len(results) == 0:
             return "未找到任何相关的实体或边。"
 
         output_results: list[SearchResultEntityOutput | SearchResultEdgeOutput] = []
         for item in results:
-            if isinstance(item, SearchResultEntity):
-                final_entity_type: EntityTypeEnum
-                match item.type:
-                    case "人物":
-                        final_entity_type = EntityTypeEnum.PERSON
-                    case "地点":
-                        final_entity_type = EntityTypeEnum.PLACE
-                    case "物品":
-                        final_entity_type = EntityTypeEnum.ITEM
-                    case "组织":
-                        final_entity_type = EntityTypeEnum.ORGANIZATION
-                    case _:
-                        raise ValueError(
-                            f"未知的实体类型: {item.type}"
-                        )  # 除非图数据损坏，这不可能发生，因此直接抛出异常
+            if item.kind == "entity":
+                final_entity_type = _STR_TO_ENUM.get(item.type)
+                if final_entity_type is None:
+                    raise ValueError(
+                        f"未知的实体类型: {item.type}"
+                    )  # 除非图数据损坏，这不可能发生，因此直接抛出异常
                 output_results.append(
-                    SearchResultEntityOutput(
+                    SearchResultEntityOutput.model_construct(
                         id=str(item.id),
                         type=final_entity_type,
                         score=item.score,
@@ -219,7 +259,7 @@ def search_graph_tool(
                 )
             else:
                 output_results.append(
-                    SearchResultEdgeOutput(
+                    SearchResultEdgeOutput.model_construct(
                         id=str(item.id),
                         from_entity_id=str(item.from_entity_id),
                         to_entity_id=str(item.to_entity_id),
@@ -259,39 +299,18 @@ class EntityOutput(BaseModel):
     """
 
 
-@tool
-def get_entity_tool(
-    entity_id: str,
-    world: Annotated[World, InjectedState("world")],
-) -> EntityOutput | str:
+def _get_entity_output(entity_id: str, world: World) -> EntityOutput | str:
     """
-    根据实体 ID 获取实体的详细信息
-
-    - entity_id: 实体的唯一标识符（UUID）
+    获取单个实体的输出，失败时返回错误描述
     """
     try:
-        entity_uuid = uuid.UUID(entity_id)
+        entity_uuid = _parse_uuid(entity_id)
         entity = world.get_entity(entity_uuid)
         if entity is None:
             return f"未找到 ID 为 {entity_id} 的实体。"
-        final_entity_type: EntityTypeEnum
-        match entity.type:
-            case EntityType.PERSON:
-                final_entity_type = EntityTypeEnum.PERSON
-            case EntityType.PLACE:
-                final_entity_type = EntityTypeEnum.PLACE
-            case EntityType.ITEM:
-                final_entity_type = EntityTypeEnum.ITEM
-            case EntityType.ORGANIZATION:
-                final_entity_type = EntityTypeEnum.ORGANIZATION
-        attribute_models = {
-            key: [
-                AttributeValueModel(value=av.value, timestamp_desc=av.timestamp_desc)
-                for av in values
-            ]
-            for key, values in entity.attributes.items()
-        }
-        return EntityOutput(
+        final_entity_type = _TYPE_TO_ENUM[entity.type]
+        attribute_models = _to_attr_models(entity.attributes)
+        return EntityOutput.model_construct(
             id=str(entity.id),
             type=final_entity_type,
             attributes=attribute_models,
@@ -300,6 +319,37 @@ def get_entity_tool(
         return f"获取实体信息时出错: {str(e)}"
 
 
+@tool
+async def get_entity_tool(
+    entity_id: str,
+    world: Annotated[World, InjectedState("world")],
+) -> EntityOutput | str:
+    """
+    根据实体 ID 获取实体的详细信息
+
+    如果需要获取多个实体，请使用 `get_entities_tool` 一次获取。
+
+    - entity_id: 实体的唯一标识符（UUID）
+    """
+    return _get_entity_output(entity_id, world)
+
+
+@tool
+async def get_entities_tool(
+    entity_ids: list[str],
+    world: Annotated[World, InjectedState("world")],
+) -> list[EntityOutput | str]:
+    """
+    根据多个实体 ID 一次性获取这些实体的详细信息
+
+    当你手上有两个及以上的实体 ID（例如来自 `search_graph_tool` 的结果）时，优先使用此工具，而不是多次调用 `get_entity_tool`。
+    返回列表与输入 ID 一一对应，获取失败的项为错误描述。
+
+    - entity_ids: 实体的唯一标识符（UUID）列表
+    """
+    return [_get_entity_output(entity_id, world) for entity_id in entity_ids]
+
+
 class EdgeOutput(BaseModel):
     """
     边信息输出
@@ -331,29 +381,17 @@ class EdgeOutput(BaseModel):
     """
 
 
-@tool
-def get_edge_tool(
-    edge_id: str,
-    world: Annotated[World, InjectedState("world")],
-) -> EdgeOutput | str:
+def _get_edge_output(edge_id: str, world: World) -> EdgeOutput | str:
     """
-    根据边 ID 获取边的详细信息
-
-    - edge_id: 边的唯一标识符（UUID）
+    获取单条边的输出，失败时返回错误描述
     """
     try:
-        edge_uuid = uuid.UUID(edge_id)
+        edge_uuid = _parse_uuid(edge_id)
         edge = world.get_edge(edge_uuid)
         if edge is None:
             return f"未找到 ID 为 {edge_id} 的边。"
-        attribute_models = {
-            key: [
-                AttributeValueModel(value=av.value, timestamp_desc=av.timestamp_desc)
-                for av in values
-            ]
-            for key, values in edge.attributes.items()
-        }
-        return EdgeOutput(
+        attribute_models = _to_attr_models(edge.attributes)
+        return EdgeOutput.model_construct(
             id=str(edge.id),
             from_entity_id=str(edge.from_entity_id),
             to_entity_id=str(edge.to_entity_id),
@@ -363,6 +401,37 @@ def get_edge_tool(
         return f"获取边信息时出错: {str(e)}"
 
 
+@tool
+async def get_edge_tool(
+    edge_id: str,
+    world: Annotated[World, InjectedState("world")],
+) -> EdgeOutput | str:
+    """
+    根据边 ID 获取边的详细信息
+
+    如果需要获取多条边，请使用 `get_edges_tool` 一次获取。
+
+    - edge_id: 边的唯一标识符（UUID）
+    """
+    return _get_edge_output(edge_id, world)
+
+
+@tool
+async def get_edges_tool(
+    edge_ids: list[str],
+    world: Annotated[World, InjectedState("world")],
+) -> list[EdgeOutput | str]:
+    """
+    根据多个边 ID 一次性获取这些边的详细信息
+
+    当你手上有两个及以上的边 ID（例如来自 `search_graph_tool` 的结果）时，优先使用此工具，而不是多次调用 `get_edge_tool`。
+    返回列表与输入 ID 一一对应，获取失败的项为错误描述。
+
+    - edge_ids: 边的唯一标识符（UUID）列表
+    """
+    return [_get_edge_output(edge_id, world) for edge_id in edge_ids]
+
+
 class RelatedEdgeOutput(BaseModel):
     """
     相关边信息输出
@@ -385,7 +454,7 @@ class RelatedEdgeOutput(BaseModel):
 
 
 @tool
-def get_related_edges_tool(
+async def get_related_edges_tool(
     entity_id: str,
     world: Annotated[World, InjectedState("world")],
 ) -> list[RelatedEdgeOutput] | str:
@@ -395,7 +464,7 @@ def get_related_edges_tool(
     - entity_id: 实体的唯一标识符（UUID）
     """
     try:
-        entity_uuid = uuid.UUID(entity_id)
+        entity_uuid = _parse_uuid(entity_id)
         edges = world.get_related_edges(entity_uuid)
 
         if edges is None:
@@ -410,7 +479,7 @@ def get_related_edges_tool(
             end_entity_id = str(end.id)
             edge_id = str(edge.id)
             output_edges.append(
-                RelatedEdgeOutput(
+                RelatedEdgeOutput.model_construct(
                     start_entity=start_entity_id, edge=edge_id, end_entity=end_entity_id
                 )
             )
@@ -441,7 +510,7 @@ class EdgeBetweenEntitiesOutput(BaseModel):
 
 
 @tool
-def get_edges_between_entities_tool(
+async def get_edges_between_entities_tool(
     from_entity_id: str,
     to_entity_id: str,
     world: Annotated[World, InjectedState("world")],
@@ -453,8 +522,8 @@ def get_edges_between_entities_tool(
     - to_entity_id: 目标实体的唯一标识符（UUID）
     """
     try:
-        from_entity_uuid = uuid.UUID(from_entity_id)
-        to_entity_uuid = uuid.UUID(to_entity_id)
+        from_entity_uuid = _parse_uuid(from_entity_id)
+        to_entity_uuid = _parse_uuid(to_entity_id)
         edges = world.get_edges_between(from_entity_uuid, to_entity_uuid)
 
         if edges is None:
@@ -465,7 +534,7 @@ def get_edges_between_entities_tool(
 
         output_edges: list[EdgeBetweenEntitiesOutput] = []
         for edge in edges:
-            edge_output = EdgeBetweenEntitiesOutput(
+            edge_output = EdgeBetweenEntitiesOutput.model_construct(
                 id=str(edge.id),
                 from_entity_id=str(edge.from_entity_id),
                 to_entity_id=str(edge.to_entity_id),
@@ -477,7 +546,7 @@ def get_edges_between_entities_tool(
 
 
 @tool
-def delete_entity_tool(
+async def delete_entity_tool(
     entity_id: str,
     world: Annotated[World, InjectedState("world")],
 ) -> str:
@@ -487,8 +556,8 @@ def delete_entity_tool(
     - entity_id: 实体的唯一标识符（UUID）
     """
     try:
-        entity_uuid = uuid.UUID(entity_id)
-        success = asyncio.run(world.delete_entity(entity_uuid))
+        entity_uuid = _parse_uuid(entity_id)
+        success = await world.delete_entity(entity_uuid)
         if success:
             return f"成功删除 ID 为 {entity_id} 的实体。"
         else:
@@ -498,7 +567,7 @@ def delete_entity_tool(
 
 
 @tool
-def delete_edge_tool(
+async def delete_edge_tool(
     edge_id: str,
     world: Annotated[World, InjectedState("world")],
 ) -> str:
@@ -508,8 +577,8 @@ def delete_edge_tool(
     - edge_id: 边的唯一标识符（UUID）
     """
     try:
-        edge_uuid = uuid.UUID(edge_id)
-        success = asyncio.run(world.delete_edge(edge_uuid))
+        edge_uuid = _parse_uuid(edge_id)
+        success = await world.delete_edge(edge_uuid)
         if success:
             return f"成功删除 ID 为 {edge_id} 的边。"
         else:
@@ -519,7 +588,7 @@ def delete_edge_tool(
 
 
 @tool
-def append_entity_attributes_tool(
+async def append_entity_attributes_tool(
     entity_id: str,
     new_attributes: dict[str, AttributeValueModel],
     world: Annotated[World, InjectedState("world")],
@@ -536,27 +605,20 @@ def append_entity_attributes_tool(
       - 注意，直接使用属性类别作为键，直接使用属性值列表作为值。不要使用"key"/"value"或者"属性类别"等多余键值。
     """
     try:
-        entity_uuid = uuid.UUID(entity_id)
+        entity_uuid = _parse_uuid(entity_id)
         entity = world.get_entity(entity_uuid)
         if entity is None:
             return f"未找到 ID 为 {entity_id} 的实体。"
         for key, av in new_attributes.items():
-            if key in entity.attributes:
-                entity.attributes[key].append(
-                    AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                )
-            else:
-                entity.attributes[key] = [
-                    AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                ]
-        asyncio.run(world.replace_entity(entity))
+            entity.attributes.setdefault(key, []).append(_to_attr_value(av))
+        await world.replace_entity(entity)
         return f"成功更新 ID 为 {entity_id} 的实体属性。"
     except Exception as e:
         return f"更新实体属性时出错: {str(e)}"
 
 
 @tool
-def replace_entity_attributes_tool(
+async def replace_entity_attributes_tool(
     entity_id: str,
     new_attributes: dict[str, list[AttributeValueModel]],
     world: Annotated[World, InjectedState("world")],
@@ -576,26 +638,20 @@ def replace_entity_attributes_tool(
       - 注意，直接使用属性类别作为键，直接使用属性值列表作为值。不要使用"key"/"value"或者"属性类别"等多余键值。
     """
     try:
-        entity_uuid = uuid.UUID(entity_id)
+        entity_uuid = _parse_uuid(entity_id)
         entity = world.get_entity(entity_uuid)
         if entity is None:
             return f"未找到 ID 为 {entity_id} 的实体。"
-        updated_attributes = {
-            key: [
-                AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                for av in values
-            ]
-            for key, values in new_attributes.items()
-        }
+        updated_attributes = _to_attr_values(new_attributes)
         entity.attributes = updated_attributes
-        asyncio.run(world.replace_entity(entity))
+        await world.replace_entity(entity)
         return f"成功更新 ID 为 {entity_id} 的实体属性。"
     except Exception as e:
         return f"更新实体属性时出错: {str(e)}"
 
 
 @tool
-def append_edge_attributes_tool(
+async def append_edge_attributes_tool(
     edge_id: str,
     new_attributes: dict[str, AttributeValueModel],
     world: Annotated[World, InjectedState("world")],
@@ -612,27 +668,20 @@ def append_edge_attributes_tool(
       - 注意，直接使用属性类别作为键，直接使用属性值列表作为值。不要使用"key"/"value"或者"属性类别"等多余键值。
     """
     try:
-        edge_uuid = uuid.UUID(edge_id)
+        edge_uuid = _parse_uuid(edge_id)
         edge = world.get_edge(edge_uuid)
         if edge is None:
             return f"未找到 ID 为 {edge_id} 的边。"
         for key, av in new_attributes.items():
-            if key in edge.attributes:
-                edge.attributes[key].append(
-                    AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                )
-            else:
-                edge.attributes[key] = [
-                    AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                ]
-        asyncio.run(world.replace_edge(edge))
+            edge.attributes.setdefault(key, []).append(_to_attr_value(av))
+        await world.replace_edge(edge)
         return f"成功更新 ID 为 {edge_id} 的边属性。"
     except Exception as e:
         return f"更新边属性时出错: {str(e)}"
 
 
 @tool
-def replace_edge_attributes_tool(
+async def replace_edge_attributes_tool(
     edge_id: str,
     new_attributes: dict[str, list[AttributeValueModel]],
     world: Annotated[World, InjectedState("world")],
@@ -652,19 +701,13 @@ def replace_edge_attributes_tool(
       - 注意，直接使用属性类别作为键，直接使用属性值列表作为值。不要使用"key"/"value"或者"属性类别"等多余键值。
     """
     try:
-        edge_uuid = uuid.UUID(edge_id)
+        edge_uuid = _parse_uuid(edge_id)
         edge = world.get_edge(edge_uuid)
         if edge is None:
             return f"未找到 ID 为 {edge_id} 的边。"
-        updated_attributes = {
-            key: [
-                AttributeValue(value=av.value, timestamp_desc=av.timestamp_desc)
-                for av in values
-            ]
-            for key, values in new_attributes.items()
-        }
+        updated_attributes = _to_attr_values(new_attributes)
         edge.attributes = updated_attributes
-        asyncio.run(world.replace_edge(edge))  # replace触发向量库更新
+        await world.replace_edge(edge)  # replace触发向量库更新
         return f"成功更新 ID 为 {edge_id} 的边属性。"
     except Exception as e:
         return f"更新边属性时出错: {str(e)}"
@@ -675,7 +718,9 @@ full_tools: list[BaseTool] = [
     add_edge_tool,
     search_graph_tool,
     get_entity_tool,
+    get_entities_tool,
     get_edge_tool,
+    get_edges_tool,
     get_related_edges_tool,
     get_edges_between_entities_tool,
     delete_entity_tool,
@@ -692,7 +737,9 @@ full_tools: list[BaseTool] = [
 read_only_tools: list[BaseTool] = [
     search_graph_tool,
     get_entity_tool,
+    get_entities_tool,
     get_edge_tool,
+    get_edges_tool,
     get_related_edges_tool,
     get_edges_between_entities_tool,
 ]
@@ -3,12 +3,36 @@ import os
 from typing import Annotated
 from uuid import UUID
 import aiofiles
+from aiofiles.threadpool.text import AsyncTextIOWrapper
 from langchain_core.tools import tool, BaseTool  # type: ignore
 from langgraph.prebuilt import InjectedState
 from chapter import ChapterInfo
 import project_instant
 
 
+class _OutputFile:
+    """
+    某个章节输出文件的持久追加句柄
+
+    句柄在第一次写入时打开，在章节写作结束时由 close_output_file 关闭，
+    避免每写一个段落就打开、关闭一次文件
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = asyncio.Lock()
+        """
+        保证并行的工具调用按顺序写入且只写一次标题
+        """
+        self.file: AsyncTextIOWrapper | None = None
+
+
+_output_files: dict[str, _OutputFile] = {}
+"""
+当前打开的章节输出文件，键为输出文件路径
+"""
+
+
 async def append_to_output_file(
     paragraph: str, project_id: UUID, chapter_index: int, chapter_info: ChapterInfo
 ):
@@ -17,27 +41,43 @@ async def append_to_output_file(
     """
     output_path = project_instant.output_path(project_id, chapter_index, chapter_info)
 
-    # 确保目录存在
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-    file_exists = os.path.exists(output_path)
-    is_empty = True
+    # 输出目录在项目初始化时已创建，句柄只在第一次写入时创建
+    output_file = _output_files.get(output_path)
+    if output_file is None:
+        output_file = _output_files[output_path] = _OutputFile(output_path)
+    async with output_file.lock:
+        if output_file.file is None:
+            output_file.file = await aiofiles.open(
+                output_path, mode="a", encoding="utf-8"
+            )
+        f = output_file.file
+        # 通过文件末尾位置判断是否为空文件，无需读出全部内容
+        await f.seek(0, os.SEEK_END)
+        is_empty = await f.tell() == 0
+        header = f"# {chapter_info.title}\n" if is_empty else ""
+        await f.write(header + "\n" + paragraph + "\n")
+        # 立即落盘，保证前端读取章节内容时能看到最新段落
+        await f.flush()
 
-    if file_exists:
-        # 这里用只读方式检查文件是否为空
-        async with aiofiles.open(output_path, mode="r", encoding="utf-8") as f:
-            content = await f.read()
-            is_empty = content.strip() == ""
 
-    # 再以追加模式写入
-    async with aiofiles.open(output_path, mode="a", encoding="utf-8") as f:
-        if not file_exists or is_empty:
-            await f.write(f"# {chapter_info.title}\n")
-        await f.write("\n" + paragraph + "\n")
+async def close_output_file(
+    project_id: UUID, chapter_index: int, chapter_info: ChapterInfo
+):
+    """
+    关闭指定章节的输出文件句柄（如果已打开）
+    """
+    output_path = project_instant.output_path(project_id, chapter_index, chapter_info)
+    output_file = _output_files.pop(output_path, None)
+    if output_file is None:
+        return
+    async with output_file.lock:
+        if output_file.file is not None:
+            await output_file.file.close()
+            output_file.file = None
 
 
 @tool
-def add_paragraph_tool(
+async def add_paragraph_tool(
     content: str,
     project_id: Annotated[UUID, InjectedState("project_id")],
     current_chapter_index: Annotated[int, InjectedState("current_chapter_index")],
@@ -50,13 +90,11 @@ def add_paragraph_tool(
     """
 
     try:
-        asyncio.run(
-            append_to_output_file(
-                content,
-                project_id,
-                current_chapter_index,
-                current_chapter_info,
-            )
+        await append_to_output_file(
+            content,
+            project_id,
+            current_chapter_index,
+            current_chapter_info,
         )
         return "段落已成功添加到输出文件。"
     except Exception as e:
@@ -1,6 +1,14 @@
-import aiofiles
-from pydantic import BaseModel, Field
+import asyncio
+from typing import Any
+from pydantic import BaseModel, Field, PrivateAttr
 import yaml
+from fs_utils import read_text, write_text_if_changed
+
+try:
+    # 优先使用 libyaml 的 C 实现，速度远快于纯 Python 实现
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
 
 
 class ChapterInfo(BaseModel):
@@ -26,21 +34,76 @@ class ChapterInfos(BaseModel):
 
     chapters: list[ChapterInfo] = Field(default_factory=list[ChapterInfo])
 
+    _title_index: dict[str, int] = PrivateAttr(default_factory=dict[str, int])
+    """
+    章节标题到索引的映射，标题重复时指向第一个出现的位置
+    """
+
+    def model_post_init(self, context: Any, /) -> None:
+        self._rebuild_title_index()
+
+    def _rebuild_title_index(self):
+        self._title_index = {}
+        for i, ci in enumerate(self.chapters):
+            self._title_index.setdefault(ci.title, i)
+
+    def index_of(self, title: str) -> int | None:
+        """
+        根据章节标题获取章节索引，不存在则返回 None
+        """
+        return self._title_index.get(title)
+
+    def insert(self, index: int, chapter_info: ChapterInfo):
+        """
+        在指定索引处插入章节
+        """
+        self.chapters.insert(index, chapter_info)
+        self._rebuild_title_index()
+
+    def append(self, chapter_info: ChapterInfo):
+        """
+        添加章节为最后一章
+        """
+        self.chapters.append(chapter_info)
+        self._title_index.setdefault(chapter_info.title, len(self.chapters) - 1)
+
+    def remove(self, index: int) -> ChapterInfo:
+        """
+        删除指定索引处的章节，并返回被删除的章节
+        """
+        removed = self.chapters.pop(index)
+        self._rebuild_title_index()
+        return removed
+
+    def rename(self, index: int, new_title: str):
+        """
+        修改指定索引处章节的标题
+        """
+        self.chapters[index].title = new_title
+        self._rebuild_title_index()
+
+
+def _parse(content: str) -> ChapterInfos:
+    """
+    将 YAML 文本解析为章节信息
+    """
+    data = yaml.load(content, Loader=SafeLoader)
+    return ChapterInfos.model_validate(data)
+
 
 async def load_from_file(file_path: str) -> ChapterInfos:
     """
     从指定的 YAML 文件加载章节信息。
     """
-    async with aiofiles.open(file_path, mode="r", encoding="utf-8") as f:
-        content = await f.read()
-        data = yaml.safe_load(content)
-        return ChapterInfos.model_validate(data)
+    content = await read_text(file_path)
+    return await asyncio.to_thread(_parse, content)
 
 
 async def save_to_file(chapters: ChapterInfos, file_path: str):
     """
     将章节信息保存到指定的 YAML 文件。
     """
-    async with aiofiles.open(file_path, mode="w", encoding="utf-8") as f:
-        content = yaml.safe_dump(chapters.model_dump())
-        await f.write(content)
+    # model_dump 在事件循环上完成，得到一份不会再被 agent 修改的快照
+    data = chapters.model_dump()
+    content = await asyncio.to_thread(yaml.dump, data, Dumper=SafeDumper)
+    await write_text_if_changed(file_path, content)
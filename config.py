@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+import functools
 import os
 
 from dotenv import load_dotenv
@@ -17,6 +18,7 @@ class Config:
     vector_dimension: int
 
     @classmethod
+    @functools.cache
     def from_env(cls) -> "Config":
         writer_api_key = os.getenv("WRITER_API_KEY")
         if not writer_api_key:
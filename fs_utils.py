@@ -1,22 +1,193 @@
 import asyncio
+from fnmatch import fnmatchcase
+import hashlib
+import os
 from pathlib import Path
+import tempfile
 from typing import AsyncGenerator
 
 
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_text(path: str, content: str):
+    _write_bytes(path, content.encode("utf-8"))
+
+
+def _write_bytes(path: str, data: bytes):
+    # 先写入同目录下的唯一临时文件，落盘后再原子替换，
+    # 进程崩溃或断电都不会留下写了一半的文件，并发写入同一文件也不会互相覆盖临时数据
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+async def read_text(path: str) -> str:
+    """
+    异步读取整个文本文件（UTF-8）
+
+    打开、读取、关闭在同一次线程池调用中完成，
+    而 aiofiles 的每一步都需要单独切换一次线程
+    """
+    return await asyncio.to_thread(_read_text, path)
+
+
+async def read_bytes(path: str) -> bytes:
+    """
+    异步读取整个文件的原始字节，不做解码
+
+    适合直接交给能解析 UTF-8 字节的解析器，例如 pydantic 的 model_validate_json
+    """
+    return await asyncio.to_thread(_read_bytes, path)
+
+
+async def write_text(path: str, content: str):
+    """
+    异步将文本（UTF-8）写入文件，覆盖已有内容
+
+    打开、写入、关闭在同一次线程池调用中完成，
+    内容先写入临时文件再原子替换目标文件
+    """
+    await asyncio.to_thread(_write_text, path, content)
+
+
+async def write_bytes(path: str, data: bytes):
+    """
+    异步将字节写入文件，覆盖已有内容
+
+    与 write_text 相同，先写入临时文件再原子替换目标文件
+    """
+    await asyncio.to_thread(_write_bytes, path, data)
+
+
+_written_digests: dict[str, tuple[bytes, int, int]] = {}
+"""
+每个文件最近一次由 write_text_if_changed 写入的内容摘要及写入后文件的 (st_mtime_ns, st_size)，
+键为文件路径
+"""
+
+
+def _write_text_if_changed(path: str, content: str) -> bool:
+    data = content.encode("utf-8")
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    cached = _written_digests.get(path)
+    if cached is not None and cached[0] == digest:
+        # 文件在别处被修改、删除或重新创建后 stat 不再一致，此时不能跳过
+        try:
+            st = os.stat(path)
+        except OSError:
+            pass
+        else:
+            if (st.st_mtime_ns, st.st_size) == cached[1:]:
+                return False
+    _write_bytes(path, data)
+    st = os.stat(path)
+    _written_digests[path] = (digest, st.st_mtime_ns, st.st_size)
+    return True
+
+
+async def write_text_if_changed(path: str, content: str) -> bool:
+    """
+    异步将文本（UTF-8）写入文件，内容与上次写入的完全相同且文件未被其他途径改动时跳过
+
+    返回是否真正进行了写入
+    """
+    return await asyncio.to_thread(_write_text_if_changed, path, content)
+
+
+def forget_written_digests(directory: str):
+    """
+    丢弃某个目录下所有文件的写入摘要，例如在删除项目目录之后
+    """
+    prefix = os.path.join(os.path.abspath(directory), "")
+    for path in [p for p in _written_digests if os.path.abspath(p).startswith(prefix)]:
+        del _written_digests[path]
+
+
+def _scan_dir(dir: Path) -> list[tuple[str, bool]]:
+    """
+    列出目录下的所有条目，返回 (名称, 是否为目录) 列表
+
+    目录不存在或无法读取时返回空列表
+    """
+    try:
+        with os.scandir(dir) as it:
+            return [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in it]
+    except OSError:
+        return []
+
+
 async def async_rglob(
     root: str | Path,
     pattern: str = "*",
+    workers: int = 8,
+    skip_hidden: bool = True,
 ) -> AsyncGenerator[Path, None]:
     """
     异步递归遍历目录，返回匹配到的文件路径。
 
     - root: 起始目录
-    - pattern: 匹配模式，默认为 "*"（所有文件）
+    - pattern: 匹配模式，默认为 "*"（所有文件），只匹配文件名，不支持包含路径分隔符的模式
+    - workers: 并发扫描目录的任务数
+    - skip_hidden: 是否跳过以 "." 开头的隐藏目录（如 .git），不进入其中扫描
+
+    以广度优先的方式由多个任务并发扫描目录，每发现一个匹配的路径就立即产出，
+    无需等待整棵目录树遍历完成
     """
     root = Path(root)
-
     loop = asyncio.get_running_loop()
-    files = await loop.run_in_executor(None, lambda: list(root.rglob(pattern)))
+    pending: asyncio.Queue[Path] = asyncio.Queue()
+    found: asyncio.Queue[Path | None] = asyncio.Queue()
+    pending.put_nowait(root)
+
+    async def worker():
+        while True:
+            dir = await pending.get()
+            try:
+                entries = await loop.run_in_executor(None, _scan_dir, dir)
+                for name, is_dir in entries:
+                    path = dir / name
+                    if is_dir and not (skip_hidden and name.startswith(".")):
+                        pending.put_nowait(path)
+                    if fnmatchcase(name, pattern):
+                        found.put_nowait(path)
+            finally:
+                pending.task_done()
+
+    async def coordinator():
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            await pending.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # None 表示遍历结束
+            found.put_nowait(None)
 
-    for file in files:
-        yield file
+    coordinator_task = asyncio.create_task(coordinator())
+    try:
+        while (path := await found.get()) is not None:
+            yield path
+    finally:
+        coordinator_task.cancel()
@@ -1,4 +1,5 @@
 import asyncio
+import sys
 from project_instant import ProjectInstant
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 from agent import world_setup_graph
@@ -32,13 +33,20 @@ async def main():
             current_messages.append(HumanMessage(content=user_input))
             state["messages"] = current_messages
 
-            final_state_snapshot = None
             async for event in world_setup_graph.astream(  # type: ignore
                 state, config={"recursion_limit": 114514}
             ):  # type: ignore
                 for node_name, value_update in event.items():
                     print(f"--- [节点: {node_name}] ---")
 
+                    # 按 State 的 reducer 语义就地合并每个节点的输出，
+                    # messages 追加，其余字段直接覆盖，无需保留事件快照
+                    for key, value in value_update.items():
+                        if key == "messages":
+                            state["messages"].extend(value)
+                        else:
+                            state[key] = value  # type: ignore
+
                     if "messages" in value_update:
                         new_messages = value_update["messages"]
                         if new_messages:
@@ -56,17 +64,8 @@ async def main():
                                     f"🛠️ Tool Result (`{latest_message.name}`): {latest_message.content}"
                                 )
 
-                # 保存每个步骤结束后的完整状态快照
-                final_state_snapshot = event
-
             print("\n--- [流程结束] ---\n")
 
-            if final_state_snapshot:
-                last_node_name = list(final_state_snapshot.keys())[-1]
-                state.update(
-                    final_state_snapshot[last_node_name]
-                )  # 合并 state 与最后一个节点的输出
-
         except KeyboardInterrupt:
             print("\nGoodbye!")
             break
@@ -75,4 +74,10 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if sys.platform != "win32":
+        # uvloop 随 uvicorn[standard] 一起安装，非 Windows 平台上用它驱动事件循环
+        import uvloop
+
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -1,6 +1,12 @@
 from pydantic import BaseModel, Field, ValidationError
 import yaml
-import aiofiles
+from fs_utils import read_text, write_text_if_changed
+
+try:
+    # 优先使用 libyaml 的 C 实现，速度远快于纯 Python 实现
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
 
 
 class Outline(BaseModel):
@@ -36,14 +42,13 @@ async def load_from_file(path: str) -> Outline:
     如果失败，则抛出 OutlineLoadError 异常。
     """
     try:
-        async with aiofiles.open(path, "r", encoding="utf-8") as f:
-            content = await f.read()
-            data = yaml.safe_load(content)
-            if not isinstance(data, dict):
-                raise OutlineLoadError(f"文件 '{path}' 的内容不是有效的字典结构。")
+        content = await read_text(path)
+        data = yaml.load(content, Loader=SafeLoader)
+        if not isinstance(data, dict):
+            raise OutlineLoadError(f"文件 '{path}' 的内容不是有效的字典结构。")
 
-            # Pydantic v2 推荐用 model_validate
-            return Outline.model_validate(data)
+        # Pydantic v2 推荐用 model_validate
+        return Outline.model_validate(data)
 
     except FileNotFoundError as e:
         raise OutlineLoadError(f"找不到大纲文件 '{path}'。") from e
@@ -60,9 +65,10 @@ async def save_to_file(outline: Outline, path: str):
     """
     try:
         data_to_save = outline.model_dump()
-        async with aiofiles.open(path, "w", encoding="utf-8") as f:
-            yaml_str = yaml.dump(data_to_save, allow_unicode=True, sort_keys=False)
-            await f.write(yaml_str)
+        yaml_str = yaml.dump(
+            data_to_save, Dumper=SafeDumper, allow_unicode=True, sort_keys=False
+        )
+        await write_text_if_changed(path, yaml_str)
 
     except IOError as e:
         # 捕获所有可能的IO错误 (如权限不足、路径不存在等)
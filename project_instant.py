@@ -1,3 +1,7 @@
+import asyncio
+import functools
+import os
+from typing import Any, Coroutine, Literal, TypeAlias
 from uuid import UUID, uuid4
 
 from chapter import ChapterInfo, ChapterInfos
@@ -9,6 +13,19 @@ import project_metadata
 from world import World
 
 
+ProjectPart: TypeAlias = Literal["metadata", "outline", "chapter_infos"]
+"""
+项目中需要单独保存的部分，世界记忆自行跟踪修改，不在此列
+"""
+
+ALL_PROJECT_PARTS: frozenset[ProjectPart] = frozenset(
+    ("metadata", "outline", "chapter_infos")
+)
+"""
+项目的所有部分
+"""
+
+
 class ProjectInstant:
     """
     持有一个小说项目的所有数据
@@ -40,12 +57,36 @@ class ProjectInstant:
         self.metadata = ProjectMetadata(
             name=name, id=str(self.id), phase=ProjectPhase.OUTLINE
         )
+        self.dirty: set[ProjectPart] = set(ALL_PROJECT_PARTS)
+        """
+        自上次保存以来被修改过、需要重新保存的部分，新建的项目需要完整保存
+        """
+
+        self.save_lock = asyncio.Lock()
+        """
+        保证同一项目同一时间只有一次保存在进行
+        """
+
+    def mark_dirty(self, *parts: ProjectPart):
+        """
+        标记项目的某些部分已被修改，下次保存时写入磁盘
+        """
+        self.dirty.update(parts)
+
+    @property
+    def is_dirty(self) -> bool:
+        """
+        项目是否有尚未保存的修改
+        """
+        return bool(self.dirty) or self.world.is_dirty
 
     async def initialize(self):
         """
         初始化一些异步资源，必须在创建之后尽早调用
         """
         await self.world.initialize()
+        # 章节输出目录只在这里创建一次，读写章节时无需再检查
+        await asyncio.to_thread(os.makedirs, outputs_directory(self.id), exist_ok=True)
 
     async def close(self):
         """
@@ -68,6 +109,8 @@ async def load_from_directory(dir: str) -> ProjectInstant:
     instant.world = World(persistent_path=dir)
     instant.outline = await outline.load_from_file(outline_path(instant.id))
     instant.chapter_infos = await chapter.load_from_file(chapter_infos_path(instant.id))
+    instant.dirty = set()
+    instant.save_lock = asyncio.Lock()
     return instant
 
 
@@ -78,35 +121,66 @@ async def save_to_directory(instant: ProjectInstant):
     - instant: 小说项目实例
 
     不需要指定目录，它由实例的 UUID 自动决定
-    """
-
-    await project_metadata.save_to_file(instant.metadata, metadata_path(instant.id))
-    await outline.save_to_file(instant.outline, outline_path(instant.id))
-    await chapter.save_to_file(instant.chapter_infos, chapter_infos_path(instant.id))
-    await instant.world.sync_to_disk()
-
-
+    只保存被标记为已修改的部分，世界记忆自行判断是否需要同步
+    """
+
+    # 重叠的保存（例如定期同步与驱逐时的保存）依次进行，避免同时写入同一批文件
+    async with instant.save_lock:
+        dirty = instant.dirty
+        instant.dirty = set()
+        saves: list[Coroutine[Any, Any, None]] = []
+        if "metadata" in dirty:
+            saves.append(
+                project_metadata.save_to_file(
+                    instant.metadata, metadata_path(instant.id)
+                )
+            )
+        if "outline" in dirty:
+            saves.append(
+                outline.save_to_file(instant.outline, outline_path(instant.id))
+            )
+        if "chapter_infos" in dirty:
+            saves.append(
+                chapter.save_to_file(
+                    instant.chapter_infos, chapter_infos_path(instant.id)
+                )
+            )
+        # 各部分写入不同的文件，互不依赖，与世界记忆的同步一起并发进行
+        try:
+            await asyncio.gather(*saves, instant.world.sync_to_disk())
+        except Exception:
+            # 保存失败，恢复标记以便下次重试
+            instant.dirty |= dirty
+            raise
+
+
+@functools.lru_cache(maxsize=256)
 def extract_id_from_directory(dir: str) -> UUID:
     """
     从指定目录提取小说项目的 UUID
 
     这里假设目录合法
     """
-    parts = dir.split("/")
-    if len(parts) == 0:
+    name = os.path.basename(dir.rstrip("/"))
+    if not name:
         raise ValueError(f"无法从目录 '{dir}' 提取 UUID")
-    return UUID(parts[-1])
+    return UUID(name)
 
 
+@functools.lru_cache(maxsize=1024)
 def instant_directory(id: UUID) -> str:
     """
     获取某个小说项目的根存储目录
 
     - id: 小说项目的 UUID
+
+    结果按 UUID 缓存，避免每次保存都重新格式化 UUID，
+    其余的固定文件路径同样被缓存
     """
     return f"datas/{id}"
 
 
+@functools.lru_cache(maxsize=1024)
 def metadata_path(id: UUID) -> str:
     """
     获取某个小说项目的元数据文件路径
@@ -116,6 +190,7 @@ def metadata_path(id: UUID) -> str:
     return f"{instant_directory(id)}/metadata.json"
 
 
+@functools.lru_cache(maxsize=1024)
 def qdrant_path(id: UUID) -> str:
     """
     获取某个小说项目的 Qdrant 数据库文件路径
@@ -125,6 +200,7 @@ def qdrant_path(id: UUID) -> str:
     return f"{instant_directory(id)}/qdrant"
 
 
+@functools.lru_cache(maxsize=1024)
 def outline_path(id: UUID) -> str:
     """
     获取某个小说项目的大纲文件路径
@@ -134,6 +210,7 @@ def outline_path(id: UUID) -> str:
     return f"{instant_directory(id)}/outline.yaml"
 
 
+@functools.lru_cache(maxsize=1024)
 def chapter_infos_path(id: UUID) -> str:
     """
     获取某个小说项目的章节信息文件路径
@@ -143,6 +220,16 @@ def chapter_infos_path(id: UUID) -> str:
     return f"{instant_directory(id)}/chapter_infos.yaml"
 
 
+@functools.lru_cache(maxsize=1024)
+def outputs_directory(id: UUID) -> str:
+    """
+    获取某个小说项目的章节输出目录
+
+    - id: 小说项目的 UUID
+    """
+    return f"{instant_directory(id)}/outputs"
+
+
 def output_path(id: UUID, chapter_index: int, chapter_info: ChapterInfo) -> str:
     """
     获取某个小说项目指定章节的输出文件路径
@@ -150,6 +237,4 @@ def output_path(id: UUID, chapter_index: int, chapter_info: ChapterInfo) -> str:
     - id: 小说项目的 UUID
     - chapter_info: 章节信息
     """
-    return (
-        f"{instant_directory(id)}/outputs/{chapter_index:02d}_{chapter_info.title}.md"
-    )
+    return f"{outputs_directory(id)}/{chapter_index:02d}_{chapter_info.title}.md"
@@ -1,7 +1,8 @@
+import asyncio
 from enum import IntEnum
-import aiofiles
+import os
 from pydantic import BaseModel, ValidationError
-import json
+from fs_utils import read_bytes, write_text_if_changed
 
 
 class ProjectPhase(IntEnum):
@@ -50,29 +51,43 @@ class ProjectMetadataLoadError(Exception):
     pass
 
 
+_load_cache: dict[str, tuple[tuple[int, int], ProjectMetadata]] = {}
+"""
+已加载的元数据缓存，键为文件路径，值为 ((st_mtime_ns, st_size), 元数据)
+
+文件未被修改时直接复用上次的解析结果，只需一次 stat
+"""
+
+
 async def load_from_file(path: str) -> ProjectMetadata:
     """
     从指定路径加载并验证项目元数据。
     如果失败，则抛出 ProjectMetadataLoadError 异常。
+
+    返回的是缓存的副本，调用方可以随意修改
     """
     try:
-        async with aiofiles.open(path, "r", encoding="utf-8") as f:
-            content = await f.read()
-            data = json.loads(content)
-            if not isinstance(data, dict):
-                raise ProjectMetadataLoadError(
-                    f"文件 '{path}' 的内容不是有效的字典结构。"
-                )
-
-            return ProjectMetadata.model_validate(data)
+        st = await asyncio.to_thread(os.stat, path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        cached = _load_cache.get(path)
+        if cached is not None and cached[0] == stat_key:
+            return cached[1].model_copy()
+
+        content = await read_bytes(path)
+        # 解析与校验在 pydantic 内部直接基于 UTF-8 字节一次完成，
+        # 不经过中间的 Python str 和 dict
+        metadata = ProjectMetadata.model_validate_json(content)
+        _load_cache[path] = (stat_key, metadata)
+        return metadata.model_copy()
 
     except FileNotFoundError as e:
+        _load_cache.pop(path, None)
         raise ProjectMetadataLoadError(f"找不到项目元数据文件 '{path}'。") from e
-    except json.JSONDecodeError as e:
-        raise ProjectMetadataLoadError(
-            f"项目元数据文件 '{path}' JSON 格式无效。"
-        ) from e
     except ValidationError as e:
+        if any(error["type"] == "json_invalid" for error in e.errors()):
+            raise ProjectMetadataLoadError(
+                f"项目元数据文件 '{path}' JSON 格式无效。"
+            ) from e
         raise ProjectMetadataLoadError(
             f"项目元数据文件 '{path}' 内容不符合规范。"
         ) from e
@@ -84,10 +99,8 @@ async def save_to_file(metadata: ProjectMetadata, path: str):
     如果失败，则抛出 ProjectMetadataSaveError 异常。
     """
     try:
-        data_to_save = metadata.model_dump()
-        async with aiofiles.open(path, "w", encoding="utf-8") as f:
-            json_str = json.dumps(data_to_save, ensure_ascii=False, indent=4)
-            await f.write(json_str)
+        json_str = metadata.model_dump_json(indent=4)
+        await write_text_if_changed(path, json_str)
 
     except IOError as e:
         raise ProjectMetadataSaveError(f"无法保存项目元数据到文件 '{path}'。") from e
@@ -1,24 +1,36 @@
 import asyncio
-from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import functools
 import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
 import os
+from queue import SimpleQueue
 from pathlib import Path
 import shutil
-from typing import Any
+import sys
+import time
+from typing import Annotated, Any
 import uuid
+import weakref
 import aiofiles
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi import Path as PathParam
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 from fastapi.responses import PlainTextResponse
 import agent
+from agent_tools import writer_tools
 from agent import world_setup_graph, chaptering_graph
 
 from chapter import ChapterInfo, ChapterInfos
-from fs_utils import async_rglob
+from fs_utils import async_rglob, forget_written_digests
 from outline import Outline
-from project_instant import ProjectInstant
+from project_instant import ALL_PROJECT_PARTS, ProjectInstant
 import project_instant
 from project_metadata import ProjectMetadata, ProjectPhase
 from langchain_core.messages import (
@@ -32,99 +44,306 @@ import project_metadata
 import writer_agent
 
 
+_log_queue: "SimpleQueue[logging.LogRecord]" = SimpleQueue()
+"""
+日志记录的中转队列，请求处理路径只把记录放入队列，不直接写 stdout
+"""
+
+_log_listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+"""
+在后台线程中把队列中的日志记录写到 stdout，随应用的生命周期启停
+"""
+
+logger = logging.getLogger("plotweave")
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(_log_queue))
+logger.propagate = False
+
+
+_rmtree_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rmtree")
+"""
+删除项目目录专用的线程池，大项目的删除不会占用默认线程池，拖慢其他文件读写
+"""
+
+SYNC_INTERVAL = 30.0
+"""
+后台任务检查超时项目并同步修改的最长间隔，单位为秒
+"""
+
+FULL_SYNC_INTERVAL = 5 * 60
+"""
+后台任务完整保存所有活动项目的间隔，单位为秒
+"""
+
+
+ProjectId = Annotated[
+    str,
+    PathParam(
+        pattern=r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"
+    ),
+]
+"""
+路由中的项目 ID 路径参数，必须是小写带连字符的标准 UUID 形式
+
+在参数层由 FastAPI 校验，非法 ID 直接返回 422，不会进入处理函数，
+也不会被拼接进文件路径
+"""
+
+
+@dataclass(slots=True)
+class _ActiveProject:
+    """
+    内存中的一个活动项目
+    """
+
+    instance: ProjectInstant
+    """
+    项目实例
+    """
+
+    last_heartbeat: float
+    """
+    最后心跳时间，取自 time.monotonic()
+    """
+
+
 class ActiveProjectManager:
     """
     一个用于管理内存中多个活动项目实例的管理器。
     采用基于 ID 的心跳机制来决定是否释放实例。
     """
 
-    def __init__(self, inactive_timeout_minutes: int = 10):
-        # 缓存结构: { project_id: (项目实例, 最后心跳时间) }
-        self._active_projects: dict[str, tuple[ProjectInstant, datetime]] = {}
+    def __init__(self, inactive_timeout_minutes: int = 10, max_active: int = 32):
+        # 缓存结构: { project_id: 活动项目 }
+        # 按最后心跳时间从旧到新排列，收到心跳的项目会被移到末尾，
+        # 这样清理时只需从头部检查到第一个未超时的项目为止
+        self._active_projects: OrderedDict[str, _ActiveProject] = OrderedDict()
         # 为每个项目ID创建一个锁，防止并发加载时出现竞争条件
-        self._locks: dict[str, asyncio.Lock] = {}
-        self.inactive_timeout = timedelta(minutes=inactive_timeout_minutes)
+        # 锁只被弱引用，没有协程持有时自动释放，加载失败的项目也不会遗留锁
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        # 超时时间，单位为秒
+        self.inactive_timeout = inactive_timeout_minutes * 60
+        # 同时留在内存中的项目数上限，超出时释放最久没有心跳的项目
+        self.max_active = max_active
+        # 正在释放中的项目，避免同一项目被重复保存和关闭
+        self._removing: set[str] = set()
+        # 内存中有活动项目时置位，没有项目时后台任务无需醒来
+        self._not_empty = asyncio.Event()
+        # 限制同时进行的项目保存数量，避免一次性打开过多文件
+        self._save_semaphore = asyncio.Semaphore(8)
 
     async def get(self, project_id: str) -> ProjectInstant:
         """
         获取一个项目实例。如果实例不在内存中，则从磁盘加载。
         加载后会设置一个初始心跳，等待前端接管。
         """
-        if project_id in self._active_projects:
-            return self._active_projects[project_id][0]
+        # 快速路径：已加载的项目只需一次字典查找，不涉及任何锁
+        # 这里不调用 move_to_end：顺序必须与心跳时间一致，cleanup_task
+        # 才能在第一个未超时的项目处停止检查，因此只有心跳会刷新项目的新近程度
+        active = self._active_projects.get(project_id)
+        if active is not None:
+            return active.instance
 
         lock = self._locks.setdefault(project_id, asyncio.Lock())
         async with lock:
-            if project_id in self._active_projects:
-                return self._active_projects[project_id][0]
+            active = self._active_projects.get(project_id)
+            if active is not None:
+                return active.instance
 
-            print(f"加载项目到活动工作区: {project_id}")
+            logger.info("加载项目到活动工作区: %s", project_id)
             try:
                 instance = await project_instant.load_from_directory(
                     project_instant.instant_directory(uuid.UUID(project_id))
                 )
                 await instance.initialize()
                 # 加载后，设置初始心跳时间
-                self._active_projects[project_id] = (
-                    instance,
-                    datetime.now(timezone.utc),
+                self._active_projects[project_id] = _ActiveProject(
+                    instance, time.monotonic()
                 )
-                return instance
+                self._not_empty.set()
             except FileNotFoundError:
                 raise HTTPException(status_code=404, detail="项目文件未找到，无法加载")
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"加载项目时发生错误: {e}")
 
+        await self._evict_overflow(keep=project_id)
+        return instance
+
+    async def register(self, instance: ProjectInstant):
+        """
+        将一个已在内存中初始化好的项目实例直接放入活动工作区，
+        例如刚创建的项目，避免随后的请求再从磁盘重新加载一遍。
+        """
+        project_id = str(instance.id)
+        self._active_projects[project_id] = _ActiveProject(instance, time.monotonic())
+        self._not_empty.set()
+        await self._evict_overflow(keep=project_id)
+
+    async def _evict_overflow(self, keep: str):
+        """
+        活动项目数超过上限时，释放最久没有心跳且没有进行中任务的项目
+
+        - keep: 刚加载或放入的项目，调用者即将使用它，不能被释放
+        """
+        # 正在释放中的项目很快就会离开，不再计入
+        overflow = len(self._active_projects) - len(self._removing) - self.max_active
+        if overflow <= 0:
+            return
+        # 按心跳从旧到新排列，头部就是最久未活跃的项目；
+        # 正在写作或对话的项目即使最久没有心跳也不能释放，全部忙碌时暂时超出上限
+        victims = [
+            pid
+            for pid in self._active_projects
+            if pid != keep and pid not in self._removing and not _project_busy(pid)
+        ][:overflow]
+        for pid in victims:
+            logger.info("释放最久未活跃的项目实例 (超出数量上限): %s", pid)
+        results = await asyncio.gather(
+            *(self.remove(pid) for pid in victims), return_exceptions=True
+        )
+        for pid, result in zip(victims, results):
+            if isinstance(result, Exception):
+                logger.error("释放项目实例时发生错误: %s, %s", pid, result)
+
     def record_heartbeat(self, project_id: str) -> bool:
         """
         记录指定项目的心跳。如果项目不在内存中，则返回 False。
         """
-        if project_id in self._active_projects:
-            instance, _ = self._active_projects[project_id]
-            self._active_projects[project_id] = (instance, datetime.now(timezone.utc))
-            return True
-        return False
-
-    async def remove(self, project_id: str):
+        active = self._active_projects.get(project_id)
+        if active is None:
+            return False
+        active.last_heartbeat = time.monotonic()
+        self._active_projects.move_to_end(project_id)
+        return True
+
+    async def touch(self, project_id: str) -> ProjectInstant:
+        """
+        获取一个项目实例并记录心跳，不在内存中时从磁盘加载。
+        """
+        active = self._active_projects.get(project_id)
+        if active is None:
+            instance = await self.get(project_id)
+            self.record_heartbeat(project_id)
+            return instance
+        active.last_heartbeat = time.monotonic()
+        self._active_projects.move_to_end(project_id)
+        return active.instance
+
+    async def remove(self, project_id: str, save: bool = True):
         """
         从内存中手动移除一个项目。
+
+        - save: 是否在移除前保存到磁盘，项目即将被删除时无需保存
         """
 
-        if project_id in self._active_projects:
-            # 同步到磁盘以防数据丢失
-            instance, _ = self._active_projects[project_id]
-            await project_instant.save_to_directory(instance)
-            await instance.close()
+        active = self._active_projects.get(project_id)
+        if active is None or project_id in self._removing:
+            return
+        self._removing.add(project_id)
+        try:
+            if save:
+                # 同步到磁盘以防数据丢失
+                await self._save(active.instance)
+            await active.instance.close()
             del self._active_projects[project_id]
-        if project_id in self._locks:
-            del self._locks[project_id]
+            if not self._active_projects:
+                self._not_empty.clear()
+        finally:
+            self._removing.discard(project_id)
+
+    async def close_all(self):
+        """
+        完整保存并关闭所有活动项目，在应用关闭时调用
+
+        关闭项目时会写入世界记忆中尚未写入向量数据库的点
+        """
+        pids = list(self._active_projects)
+        for pid in pids:
+            self._active_projects[pid].instance.mark_dirty(*ALL_PROJECT_PARTS)
+        results = await asyncio.gather(
+            *(self.remove(pid) for pid in pids), return_exceptions=True
+        )
+        for pid, result in zip(pids, results):
+            if isinstance(result, Exception):
+                logger.error("关闭时保存项目发生错误: %s, %s", pid, result)
 
-    async def sync_to_disk(self):
+    async def sync_to_disk(self, full: bool = False):
         """
         同步现有项目到磁盘
+
+        - full: 是否无视修改标记完整保存所有项目，用于防止遗漏了某处修改标记
         """
+        if full:
+            for active in list(self._active_projects.values()):
+                active.instance.mark_dirty(*ALL_PROJECT_PARTS)
         # 同步现有项目到磁盘，防止数据丢失
-        for pid in self._active_projects.keys():
-            instance, _ = self._active_projects[pid]
+        # 只保存有修改的项目，并让它们的写入在并发上限内同时进行
+        dirty = [
+            (pid, active.instance)
+            for pid, active in list(self._active_projects.items())
+            if active.instance.is_dirty
+        ]
+        results = await asyncio.gather(
+            *(self._save(instance) for _, instance in dirty),
+            return_exceptions=True,
+        )
+        # 单个项目保存失败不影响其他项目，也不能让后台任务因此退出
+        for (pid, _), result in zip(dirty, results):
+            if isinstance(result, Exception):
+                logger.error("同步项目到磁盘时发生错误: %s, %s", pid, result)
+
+    async def _save(self, instance: ProjectInstant):
+        """
+        在并发上限内保存一个项目
+        """
+        async with self._save_semaphore:
             await project_instant.save_to_directory(instance)
 
+    def _next_check_delay(self) -> float:
+        """
+        距离下一次检查的时间，单位为秒
+
+        最多 SYNC_INTERVAL 秒检查一次，最久未活跃的项目会更早超时时提前醒来
+        """
+        oldest = next(iter(self._active_projects.values()), None)
+        if oldest is None:
+            return SYNC_INTERVAL
+        expires_in = oldest.last_heartbeat + self.inactive_timeout - time.monotonic()
+        return min(SYNC_INTERVAL, max(1.0, expires_in))
+
     async def cleanup_task(self):
         """
         一个后台任务，定期清理因心跳超时的不活跃项目。
         """
+        last_full_sync = time.monotonic()
         while True:
-            await asyncio.sleep(30)  # 每30s检查一次
-            now = datetime.now(timezone.utc)
-            inactive_ids = [
-                pid
-                for pid, (_, last_heartbeat) in self._active_projects.items()
-                if now - last_heartbeat > self.inactive_timeout
-            ]
+            # 没有活动项目时一直等待，直到有项目被加载
+            await self._not_empty.wait()
+            await asyncio.sleep(self._next_check_delay())
+            now = time.monotonic()
+            inactive_ids: list[str] = []
+            for pid, active in self._active_projects.items():
+                if now - active.last_heartbeat <= self.inactive_timeout:
+                    # 之后的项目心跳都更新，不可能超时
+                    break
+                inactive_ids.append(pid)
             for pid in inactive_ids:
-                print(f"释放不活跃的项目实例 (心跳超时): {pid}")
-                await self.remove(pid)
+                logger.info("释放不活跃的项目实例 (心跳超时): %s", pid)
+            # 各项目的保存和关闭互不依赖，一起进行，单个失败不影响其他项目
+            results = await asyncio.gather(
+                *(self.remove(pid) for pid in inactive_ids), return_exceptions=True
+            )
+            for pid, result in zip(inactive_ids, results):
+                if isinstance(result, Exception):
+                    logger.error("释放项目实例时发生错误: %s, %s", pid, result)
             # 同步现有项目到磁盘，防止数据丢失
-            await self.sync_to_disk()
+            # 平时只保存被标记为已修改的部分，每隔一段时间完整保存一次作为兜底
+            full = now - last_full_sync >= FULL_SYNC_INTERVAL
+            if full:
+                last_full_sync = now
+            await self.sync_to_disk(full=full)
 
 
 active_projects = ActiveProjectManager()
@@ -140,8 +359,9 @@ async def guardian_task():
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     """
-    启动时创建守护任务，关闭时取消它。
+    启动时创建守护任务并开始输出日志，关闭时取消它，并保存所有活动项目。
     """
+    _log_listener.start()
     task = asyncio.create_task(guardian_task())
     try:
         yield
@@ -151,30 +371,111 @@ async def lifespan(_: FastAPI):
             await task
         except asyncio.CancelledError:
             pass
+        # 先停止仍在运行的写作任务，再保存所有项目，排队中的修改不会丢失
+        running = [s.task for s in writing_sessions.values() if not s.task.done()]
+        for writing_task in running:
+            writing_task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        await active_projects.close_all()
+        _rmtree_executor.shutdown(wait=True)
+        _log_listener.stop()
 
 
 app = FastAPI(lifespan=lifespan)
+# 项目列表等较大的 JSON 响应压缩后再发送
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+
+_ROOT_BODY = json.dumps(
+    {"message": "欢迎访问剧情织机 (PlotWeave) 后端"}, ensure_ascii=False
+).encode()
+"""
+根路径的固定响应体，预先编码好
+"""
 
 
 @app.get("/")
 def read_root():
-    return {"message": "欢迎访问剧情织机 (PlotWeave) 后端"}
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
 
 class ProjectListResponse(BaseModel):
     projects: list[ProjectMetadata]
 
 
+PROJECT_LIST_CACHE_TTL = 5.0
+"""
+项目列表缓存的有效期，单位为秒
+"""
+
+_project_list_cache: tuple[float, int, bytes] | None = None
+"""
+最近一次生成的项目列表响应，(生成时间, datas 目录的 st_mtime_ns, 响应 JSON)
+
+创建、删除项目或修改元数据时清空
+"""
+
+
+def _invalidate_project_list():
+    """
+    清空项目列表缓存
+    """
+    global _project_list_cache
+    _project_list_cache = None
+
+
+def _datas_mtime_ns() -> int:
+    """
+    获取 datas 目录的修改时间，目录不存在时返回 0
+    """
+    try:
+        return os.stat("datas").st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
 @app.get("/api/projects", response_model=ProjectListResponse)
 async def list_all_projects():
     """
     获取所有已创建小说项目的元数据列表
+
+    短时间内的重复请求直接返回缓存，datas 目录有项目增删时缓存随之失效
     """
+    global _project_list_cache
+    now = time.monotonic()
+    mtime_ns = await asyncio.to_thread(_datas_mtime_ns)
+    cached = _project_list_cache
+    if (
+        cached is not None
+        and now - cached[0] < PROJECT_LIST_CACHE_TTL
+        and cached[1] == mtime_ns
+    ):
+        return Response(content=cached[2], media_type="application/json")
+
+    # 限制同时进行的读取数量，项目很多时不至于一次占满线程池
+    semaphore = asyncio.Semaphore(32)
+
+    async def load(file: Path) -> ProjectMetadata:
+        async with semaphore:
+            return await project_metadata.load_from_file(str(file))
+
+    # 每发现一个元数据文件就立即开始加载，让文件读取与目录遍历重叠进行
+    load_tasks = [
+        asyncio.create_task(load(file))
+        async for file in async_rglob(root="datas", pattern="metadata.json")
+    ]
+    results = await asyncio.gather(*load_tasks, return_exceptions=True)
+    # 单个项目的元数据损坏时跳过它，不影响其他项目的列出
     projects_list: list[ProjectMetadata] = []
-    async for file in async_rglob(root="datas", pattern="metadata.json"):
-        metadata = await project_metadata.load_from_file(str(file))
-        projects_list.append(metadata)
-    return ProjectListResponse(projects=projects_list)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("加载项目元数据时发生错误: %s", result)
+        else:
+            projects_list.append(result)
+    # 元数据刚刚校验过，直接序列化返回，跳过 FastAPI 按 response_model 的二次校验
+    content = ProjectListResponse(projects=projects_list).model_dump_json().encode()
+    _project_list_cache = (now, mtime_ns, content)
+    return Response(content=content, media_type="application/json")
 
 
 class CreateProjectRequest(BaseModel):
@@ -193,11 +494,14 @@ async def create_project(request: CreateProjectRequest):
     instant = ProjectInstant(request.name)
     await instant.initialize()
     await project_instant.save_to_directory(instant)
+    # 新建的项目通常马上就会被打开，直接保留在内存中
+    await active_projects.register(instant)
+    _invalidate_project_list()
     return instant.metadata
 
 
 @app.get("/api/projects/{project_id}", response_model=ProjectMetadata)
-async def get_project_metadata(project_id: str):
+async def get_project_metadata(project_id: ProjectId):
     """
     获取指定项目的元数据
     """
@@ -206,63 +510,87 @@ async def get_project_metadata(project_id: str):
 
 
 @app.put("/api/projects/{project_id}", response_model=ProjectMetadata)
-async def update_project_metadata(project_id: str, updated_metadata: ProjectMetadata):
+async def update_project_metadata(
+    project_id: ProjectId, updated_metadata: ProjectMetadata
+):
     """
     更新指定项目的元数据
     """
     instant = await active_projects.get(project_id)
     instant.metadata = updated_metadata
-    return instant.metadata
+    instant.mark_dirty("metadata")
+    _invalidate_project_list()
+    # 请求体刚由 FastAPI 校验过，直接序列化返回，跳过按 response_model 的二次校验
+    return Response(
+        content=instant.metadata.model_dump_json(), media_type="application/json"
+    )
 
 
 @app.delete("/api/projects/{project_id}", status_code=200)
-async def delete_project(project_id: str):
+async def delete_project(project_id: ProjectId):
     """
     删除指定的小说项目
     """
     project_dir = Path("datas") / str(project_id)  # 转换为 str
 
-    if not project_dir.exists() or not project_dir.is_dir():
+    # is_dir 对不存在的路径同样返回 False，一次 stat 即可
+    if not await asyncio.to_thread(project_dir.is_dir):
         raise HTTPException(status_code=404, detail="项目未找到")
 
     try:
-        await active_projects.remove(project_id)
-        await asyncio.to_thread(shutil.rmtree, project_dir)
+        # 目录马上就会被删除，不必先把内存中的修改写回去
+        await active_projects.remove(project_id, save=False)
+        await asyncio.get_running_loop().run_in_executor(
+            _rmtree_executor, shutil.rmtree, project_dir
+        )
+        forget_written_digests(str(project_dir))
+        _invalidate_project_list()
         return {"ok": True, "message": f"项目 {project_id} 已删除"}
     except Exception as e:
-        print(f"删除项目时发生错误: {e}")
+        logger.error("删除项目时发生错误: %s", e)
         raise HTTPException(status_code=500, detail=f"删除项目时发生错误: {e}")
 
 
+@functools.lru_cache(maxsize=1024)
+def _heartbeat_body(project_id: str) -> bytes:
+    """
+    心跳成功时的响应体，心跳非常频繁，按项目 ID 缓存编码结果
+    """
+    return json.dumps(
+        {"message": f"Project {project_id} is active and heartbeat is recorded."}
+    ).encode()
+
+
 @app.post("/api/projects/{project_id}/heartbeat", status_code=200)
-async def project_heartbeat(project_id: str):
+async def project_heartbeat(project_id: ProjectId):
     """
     接收前端对指定项目的心跳信号，以保持其活跃。
     如果项目未加载，此端点将触发加载。
     """
     try:
-        # get 方法将处理加载逻辑：如果项目不在内存中，则从磁盘加载。
-        # 如果项目文件不存在，它会正确地抛出 404 HTTPException。
-        await active_projects.get(project_id)
-
-        # 成功获取实例后，我们知道项目肯定在内存中了，再记录心跳。
-        active_projects.record_heartbeat(project_id)
-
-        return {"message": f"Project {project_id} is active and heartbeat is recorded."}
+        # 项目已在内存中时只需记录心跳，完全同步完成
+        if not active_projects.record_heartbeat(project_id):
+            # touch 方法将处理加载逻辑：如果项目不在内存中，则从磁盘加载，然后记录心跳。
+            # 如果项目文件不存在，它会正确地抛出 404 HTTPException。
+            await active_projects.touch(project_id)
+
+        return Response(
+            content=_heartbeat_body(project_id), media_type="application/json"
+        )
     except HTTPException as e:
         # 重新抛出由 get() 引起的 HTTP 异常 (例如 404 Not Found)
-        print(f"项目心跳时发生错误: {e.detail}")
+        logger.error("项目心跳时发生错误: %s", e.detail)
         raise e
     except Exception as e:
         # 捕获其他潜在的加载错误
-        print(f"激活项目时发生错误: {e}")
+        logger.error("激活项目时发生错误: %s", e)
         raise HTTPException(
             status_code=500, detail=f"An error occurred while activating project: {e}"
         )
 
 
 @app.get("/api/projects/{project_id}/outline", response_model=Outline)
-async def get_project_outline(project_id: str):
+async def get_project_outline(project_id: ProjectId):
     """
     获取指定项目的大纲。
     """
@@ -271,13 +599,100 @@ async def get_project_outline(project_id: str):
 
 
 @app.put("/api/projects/{project_id}/outline", response_model=Outline)
-async def update_project_outline(project_id: str, outline: Outline):
+async def update_project_outline(project_id: ProjectId, outline: Outline):
     """
     更新指定项目的大纲。
     """
     project_instance = await active_projects.get(project_id)
     project_instance.outline = outline
-    return project_instance.outline
+    project_instance.mark_dirty("outline")
+    # 请求体刚由 FastAPI 校验过，直接序列化返回，跳过按 response_model 的二次校验
+    return Response(
+        content=project_instance.outline.model_dump_json(),
+        media_type="application/json",
+    )
+
+
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+"""
+SSE 事件使用的 JSON 编码函数
+
+json.dumps 只在全部参数为默认值时复用内部的编码器，
+指定 ensure_ascii=False 后每次调用都会新建一个，这里预先创建好复用
+"""
+
+
+def _sse_event(data: dict[str, Any]) -> bytes:
+    """
+    将一个事件编码为 SSE 的 data 帧
+
+    直接产出 UTF-8 字节，StreamingResponse 无需再编码一次；
+    中文不转义为 \\uXXXX，帧的体积也更小
+    """
+    return b"data: " + _encode_json(data).encode() + b"\n\n"
+
+
+_SSE_STREAM_ENDED = _sse_event({"type": "end", "data": "Stream ended"})
+"""
+对话流结束时发送的固定事件，预先编码好
+"""
+
+
+def _message_event(message: BaseMessage, content_type: str) -> dict[str, Any] | None:
+    """
+    将 agent 产生的一条消息转换为推送给前端的事件，不需要推送时返回 None
+
+    - message: 图中某个节点新增的消息
+    - content_type: AI 正文内容事件的类型名
+    """
+    if isinstance(message, AIMessage):
+        if message.tool_calls:
+            tool_name = message.tool_calls[0]["name"]
+            return {"type": "thinking", "data": f"正在调用工具: `{tool_name}`..."}
+        if message.content:
+            return {"type": content_type, "data": message.content}
+    elif isinstance(message, ToolMessage):
+        return {
+            "type": "tool_result",
+            "data": f"工具 `{message.name}` 返回: {message.content}",
+        }
+    return None
+
+
+def _update_messages(value_update: Any) -> list[BaseMessage]:
+    """
+    取出图中一个节点的输出里新增的消息
+
+    节点多次写入状态时（例如工具节点同时返回 Command 和普通结果），
+    输出是更新字典的列表；不写入任何状态的节点（例如 complete）输出为 None
+    """
+    updates = value_update if isinstance(value_update, list) else [value_update]
+    messages: list[BaseMessage] = []
+    for update in updates:
+        if isinstance(update, dict):
+            messages.extend(update.get("messages", ()))  # pyright: ignore
+    return messages
+
+
+class ChatTurn(BaseModel):
+    """
+    前端传来的一条聊天历史
+    """
+
+    role: str
+    """
+    发送者，"user" 或 "assistant"
+    """
+
+    content: str = ""
+    """
+    消息内容
+    """
+
+    type: str | None = None
+    """
+    assistant 消息的类型，只有 "final" 的才是最终回复
+    """
 
 
 class ChatRequest(BaseModel):
@@ -286,11 +701,20 @@ class ChatRequest(BaseModel):
     """
 
     message: str
-    history: list[dict[str, str]] = []
+    history: list[ChatTurn] = []
+
+
+chat_streams: dict[str, int] = {}
+"""
+各项目正在进行的对话流数量，没有对话流的项目不在其中
+"""
 
 
 async def stream_agent_response(
-    project_id: str, user_message: str, history: list[dict[str, str]]
+    project_id: str,
+    user_message: str,
+    history: list[ChatTurn],
+    http_request: Request,
 ):
     """
     一个异步生成器，根据项目阶段动态选择并流式传输 Agent 的响应。
@@ -298,7 +722,7 @@ async def stream_agent_response(
     project_instance = await active_projects.get(project_id)
     if not project_instance:
         error_data = {"type": "error", "data": "项目未加载或不存在。"}
-        yield f"data: {json.dumps(error_data)}\n\n"
+        yield _sse_event(error_data)
         return
 
     # 根据项目阶段选择 Agent 和构建系统提示 ---
@@ -328,19 +752,21 @@ async def stream_agent_response(
             "type": "error",
             "data": f"项目当前阶段 {project_phase.name} 不支持交互式Agent。",
         }
-        yield f"data: {json.dumps(error_data)}\n\n"
+        yield _sse_event(error_data)
         return
 
-    messages: list[BaseMessage] = [SystemMessage(content=system_prompt)]
-    for msg in history:
-        role = msg.get("role")
-        content = msg.get("content", "")
-        if role == "user":
-            messages.append(HumanMessage(content=content))
-        elif role == "assistant" and msg.get("type") == "final":
-            messages.append(AIMessage(content=content))
-
-    messages.append(HumanMessage(content=user_message))
+    messages: list[BaseMessage] = [
+        SystemMessage(content=system_prompt),
+        *(
+            HumanMessage(content=turn.content)
+            if turn.role == "user"
+            else AIMessage(content=turn.content)
+            for turn in history
+            if turn.role == "user"
+            or (turn.role == "assistant" and turn.type == "final")
+        ),
+        HumanMessage(content=user_message),
+    ]
 
     state: agent.State = {
         "messages": messages,
@@ -349,48 +775,46 @@ async def stream_agent_response(
         "outline": project_instance.outline,
     }
 
+    # 对话期间 agent 持续修改项目，不能被释放
+    chat_streams[project_id] = chat_streams.get(project_id, 0) + 1
     try:
         # 使用动态选择的 graph 进行响应
-        async for event in graph.astream(  # type: ignore
+        events = graph.astream(  # type: ignore
             state, config={"recursion_limit": 1145141919819810}
-        ):
-            for _, value_update in event.items():
-                if "messages" in value_update:
-                    new_messages = value_update["messages"]
-                    if new_messages:
-                        latest_message = new_messages[-1]
-                        if isinstance(latest_message, AIMessage):
-                            if latest_message.tool_calls:
-                                tool_name = latest_message.tool_calls[0]["name"]
-                                stream_data = {
-                                    "type": "thinking",
-                                    "data": f"正在调用工具: `{tool_name}`...",
-                                }
-                                yield f"data: {json.dumps(stream_data)}\n\n"
-                            elif latest_message.content:  # type: ignore
-                                stream_data = {  # type: ignore
-                                    "type": "token",
-                                    "data": latest_message.content,  # type: ignore
-                                }
-                                yield f"data: {json.dumps(stream_data)}\n\n"
-                        elif isinstance(latest_message, ToolMessage):
-                            stream_data = {
-                                "type": "tool_result",
-                                "data": f"工具 `{latest_message.name}` 返回: {latest_message.content}",  # type: ignore
-                            }
-                            yield f"data: {json.dumps(stream_data)}\n\n"
+        )
+        try:
+            async for event in events:
+                for _, value_update in event.items():
+                    # 每个节点的输出只包含它新增的消息，逐条转发
+                    for message in _update_messages(value_update):
+                        stream_data = _message_event(message, "token")
+                        if stream_data is not None:
+                            yield _sse_event(stream_data)
+                # 客户端已断开时立即停止，不再为无人接收的回复继续调用模型
+                if await http_request.is_disconnected():
+                    logger.info("客户端断开连接，停止项目 %s 的对话。", project_id)
+                    return
+        finally:
+            # 立即关闭图的事件流，取消其中尚未完成的模型调用和工具调用
+            await events.aclose()
 
     except Exception as e:
-        print(f"Agent stream error: {e}")
+        logger.error("Agent stream error: %s", e)
         error_data = {"type": "error", "data": f"Agent 执行出错: {str(e)}"}
-        yield f"data: {json.dumps(error_data)}\n\n"
+        yield _sse_event(error_data)
     finally:
-        end_data = {"type": "end", "data": "Stream ended"}
-        yield f"data: {json.dumps(end_data)}\n\n"
+        # agent 可能通过工具修改了章节信息（世界记忆会自行跟踪修改）
+        project_instance.mark_dirty("chapter_infos")
+        if chat_streams[project_id] > 1:
+            chat_streams[project_id] -= 1
+        else:
+            del chat_streams[project_id]
+
+    yield _SSE_STREAM_ENDED
 
 
 @app.get("/api/projects/{project_id}/chapters", response_model=ChapterInfos)
-async def get_project_chapters(project_id: str):
+async def get_project_chapters(project_id: ProjectId):
     """
     获取指定项目的所有章节信息。
     """
@@ -404,22 +828,12 @@ async def get_project_chapters(project_id: str):
     "/api/projects/{project_id}/chapters/{chapter_index}",
     response_class=PlainTextResponse,
 )
-async def get_project_chapter_content(project_id: str, chapter_index: int):
+async def get_project_chapter_content(project_id: ProjectId, chapter_index: int):
     """
     获取指定项目的某个章节内容。
     """
     instance = await active_projects.get(project_id)
-    # 确保目录存在
-    os.makedirs(
-        os.path.dirname(
-            project_instant.output_path(
-                id=instance.id,
-                chapter_index=chapter_index,
-                chapter_info=instance.chapter_infos.chapters[chapter_index],
-            )
-        ),
-        exist_ok=True,
-    )
+    # 章节输出目录在项目初始化时已创建
     if chapter_index < 0 or chapter_index >= len(instance.chapter_infos.chapters):
         raise HTTPException(status_code=400, detail="章节索引无效")
     chapter_info = instance.chapter_infos.chapters[chapter_index]
@@ -434,16 +848,8 @@ async def get_project_chapter_content(project_id: str, chapter_index: int):
             content = await f.read()
             return PlainTextResponse(content=content)
     except FileNotFoundError:
-        # 章节文件不存在，创建一个空文件
-        async with aiofiles.open(
-            project_instant.output_path(
-                id=instance.id, chapter_index=chapter_index, chapter_info=chapter_info
-            ),
-            mode="w",
-            encoding="utf-8",
-        ) as f:
-            await f.write("")
-            return PlainTextResponse(content="")
+        # 章节尚未写作，视为空内容，文件在保存时才创建
+        return PlainTextResponse(content="")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"读取章节文件时发生错误: {e}")
 
@@ -454,7 +860,7 @@ class ChapterContent(BaseModel):
 
 @app.put("/api/projects/{project_id}/chapters/{chapter_index}")
 async def save_project_chapter_content(
-    project_id: str, chapter_index: int, chapter_body: ChapterContent
+    project_id: ProjectId, chapter_index: int, chapter_body: ChapterContent
 ):
     instance = await active_projects.get(project_id)
     if chapter_index < 0 or chapter_index >= len(instance.chapter_infos.chapters):
@@ -474,17 +880,122 @@ async def save_project_chapter_content(
         raise HTTPException(status_code=500, detail=f"保存章节文件时发生错误: {e}")
 
 
-writing_event_queues: dict[str, asyncio.Queue[None]] = {}
-writing_tasks: dict[str, asyncio.Task[dict[str, Any] | None]] = {}
+WRITING_QUEUE_SIZE = 1024
+"""
+写作任务事件队列的容量，队列已满时写作 Agent 等待客户端读取
+"""
+
+WRITING_PUBLISH_TIMEOUT = 10 * 60
+"""
+写作事件队列已满时最多等待客户端读取的时间，单位为秒，超时后放弃写作任务
+"""
+
+WRITING_SESSION_GRACE = 5 * 60
+"""
+写作任务结束后保留其会话的时间，单位为秒，客户端可以在此期间重新连接读取剩余事件
+"""
+
+
+@dataclass(slots=True)
+class _WritingSession:
+    """
+    一个项目正在进行，或已结束但事件尚未被读取完的写作任务
+    """
+
+    queue: "asyncio.Queue[dict[str, Any]]"
+    """
+    推送给前端的事件队列，任务结束且队列取空即表示事件流结束
+    """
+
+    task: "asyncio.Task[None]"
+    """
+    运行写作 Agent 的后台任务
+    """
+
+
+writing_sessions: dict[str, _WritingSession] = {}
+"""
+各项目的写作任务，每个项目同时最多一个
+"""
+
+
+def _project_busy(project_id: str) -> bool:
+    """
+    项目是否有进行中的写作任务或对话流
+    """
+    session = writing_sessions.get(project_id)
+    if session is not None and not session.task.done():
+        return True
+    return project_id in chat_streams
+
+
+async def _publish_writing_event(
+    queue: "asyncio.Queue[dict[str, Any]]", event: dict[str, Any]
+):
+    """
+    向写作事件队列放入一个事件
+
+    队列已满时等待客户端读取，不丢弃任何事件；
+    超过 WRITING_PUBLISH_TIMEOUT 仍无人读取时抛出 TimeoutError
+    """
+    await asyncio.wait_for(queue.put(event), WRITING_PUBLISH_TIMEOUT)
+
+
+async def _next_writing_event(session: _WritingSession) -> dict[str, Any] | None:
+    """
+    取出写作任务的下一个事件，任务已结束且事件已全部取出时返回 None
+    """
+    while session.queue.empty():
+        if session.task.done():
+            return None
+        getter = asyncio.ensure_future(session.queue.get())
+        try:
+            await asyncio.wait(
+                (getter, session.task), return_when=asyncio.FIRST_COMPLETED
+            )
+        except BaseException:
+            getter.cancel()
+            raise
+        if getter.done():
+            return getter.result()
+        getter.cancel()
+    return session.queue.get_nowait()
+
+
+def _discard_writing_session(project_id: str, session: _WritingSession):
+    """
+    移除一个已结束的写作会话，已被新任务替换时不做任何事
+    """
+    if writing_sessions.get(project_id) is session:
+        del writing_sessions[project_id]
+
+
+def _on_writing_task_done(
+    project_id: str, session: _WritingSession, task: "asyncio.Task[None]"
+):
+    """
+    写作任务结束时记录错误，并在 WRITING_SESSION_GRACE 秒后移除会话
+
+    客户端没有读取完事件时，会话也不会一直留在内存中
+    """
+    if not task.cancelled() and (e := task.exception()) is not None:
+        logger.error("写作任务出错: 项目 %s, %s", project_id, e)
+    task.get_loop().call_later(
+        WRITING_SESSION_GRACE, _discard_writing_session, project_id, session
+    )
 
 
 @app.post("/api/projects/{project_id}/chat/stream")
-async def chat_stream(project_id: str, request: ChatRequest):
+async def chat_stream(
+    project_id: ProjectId, request: ChatRequest, http_request: Request
+):
     """
     与指定项目的 Agent 进行流式对话。
     """
     return StreamingResponse(
-        stream_agent_response(project_id, request.message, request.history),
+        stream_agent_response(
+            project_id, request.message, request.history, http_request
+        ),
         media_type="text/event-stream",
     )
 
@@ -499,17 +1010,14 @@ class WritingRequest(BaseModel):
 
 
 async def run_writing_agent_in_background(
-    project_id: str, chapter_index: int, chapter_info: ChapterInfo
+    project_id: str,
+    chapter_index: int,
+    chapter_info: ChapterInfo,
+    queue: "asyncio.Queue[dict[str, Any]]",
 ):
     """
-    在后台执行写作 Agent 的 langgraph astream，并将事件放入对应的队列。
+    在后台执行写作 Agent 的 langgraph astream，并将事件放入此任务专用的队列。
     """
-    # 获取此任务专用的队列
-    queue = writing_event_queues.get(project_id)
-    if not queue:
-        print(f"错误：项目 {project_id} 的事件队列未找到。")
-        return
-
     try:
         project_instance = await active_projects.get(project_id)
 
@@ -524,113 +1032,107 @@ async def run_writing_agent_in_background(
             world=project_instance.world,
             metadata=project_instance.metadata,
             approved_events=[],
+            approved_events_str="",
         )
 
         async for event in writer_agent.graph.astream(  # pyright: ignore[reportUnknownMemberType]
             state, config={"recursion_limit": 1145141919810}
         ):
             for _, value_update in event.items():
-                if "messages" in value_update:
-                    latest_message = value_update["messages"][-1]
-                    stream_data = None
-                    if isinstance(latest_message, AIMessage):
-                        if latest_message.tool_calls:
-                            tool_name = latest_message.tool_calls[0]["name"]
-                            stream_data = {
-                                "type": "thinking",
-                                "data": f"正在调用工具: `{tool_name}`...",
-                            }
-                        elif latest_message.content:  # type: ignore
-                            stream_data = {  # type: ignore
-                                "type": "content_chunk",
-                                "data": latest_message.content,  # type: ignore
-                            }
-                    elif isinstance(latest_message, ToolMessage):
-                        stream_data = {
-                            "type": "tool_result",
-                            "data": f"工具 `{latest_message.name}` 返回: {latest_message.content}",  # type: ignore
-                        }
-
-                    if stream_data:
-                        await queue.put(stream_data)  # type: ignore
+                # 每个节点的输出只包含它新增的消息，逐条转发
+                for message in _update_messages(value_update):
+                    stream_data = _message_event(message, "content_chunk")
+                    if stream_data is not None:
+                        await _publish_writing_event(queue, stream_data)
+
+        # 写作完成时 agent 会推进元数据中的写作章节索引
+        project_instance.mark_dirty("metadata")
 
-    except Exception as e:
-        error_data = {"type": "error", "data": f"写作 Agent 执行出错: {str(e)}"}
-        await queue.put(error_data)  # type: ignore
-        raise e
     finally:
-        print(f"写作任务流结束: 项目 {project_id}, 章节索引 {chapter_index}")
-        # 发送结束信号
-        end_data = {"type": "end", "data": "写作任务流结束"}
-        await queue.put(end_data)  # type: ignore
-        # 放入一个 None 来告诉 stream_writing_progress 停止
-        await queue.put(None)
+        # 错误和结束信号由 stream_writing_progress 根据任务的结果发送，
+        # 不需要再挤进可能已满的队列
+        logger.info("写作任务流结束: 项目 %s, 章节索引 %s", project_id, chapter_index)
+        await writer_tools.close_output_file(
+            uuid.UUID(project_id), chapter_index, chapter_info
+        )
 
 
 @app.post("/api/projects/{project_id}/write/start", status_code=202)
-async def start_writing_chapter(project_id: str, request: WritingRequest):
+async def start_writing_chapter(project_id: ProjectId, request: WritingRequest):
     """
     为指定项目启动一个章节写作任务。
     """
     # 如果已有任务在运行，则不允许启动新任务
-    if project_id in writing_tasks and not writing_tasks[project_id].done():
+    session = writing_sessions.get(project_id)
+    if session is not None and not session.task.done():
         raise HTTPException(
             status_code=409, detail="该项目已有一个正在进行的写作任务。"
         )
 
     # 为这个任务创建一个新的事件队列
-    writing_event_queues[project_id] = asyncio.Queue()
+    queue: "asyncio.Queue[dict[str, Any]]" = asyncio.Queue(maxsize=WRITING_QUEUE_SIZE)
 
     # 在后台创建一个 Task 来运行 Agent
     task = asyncio.create_task(
         run_writing_agent_in_background(
-            project_id, request.chapter_index, request.chapter_info
+            project_id, request.chapter_index, request.chapter_info, queue
         )
     )
-    writing_tasks[project_id] = task
+    session = _WritingSession(queue, task)
+    writing_sessions[project_id] = session
+    task.add_done_callback(
+        functools.partial(_on_writing_task_done, project_id, session)
+    )
 
-    print(f"接收到项目 {project_id} 的写作请求，目标章节索引: {request.chapter_index}")
+    logger.info(
+        "接收到项目 %s 的写作请求，目标章节索引: %s", project_id, request.chapter_index
+    )
     return {"message": "写作任务已成功启动"}
 
 
 @app.get("/api/projects/{project_id}/write/stream")
-async def stream_writing_progress(project_id: str):
+async def stream_writing_progress(project_id: ProjectId):
     """
     连接并流式传输指定项目写作任务的进度。
     """
 
     async def event_generator():
         """从队列中获取事件并格式化为 SSE"""
-        queue = writing_event_queues.get(project_id)
-        if not queue:
-            # 如果队列不存在，说明任务可能还未启动或已结束
+        session = writing_sessions.get(project_id)
+        if session is None:
+            # 如果任务不存在，说明任务可能还未启动或已结束
             error_data = {"type": "error", "data": "未找到写作任务流。请先启动任务。"}
-            yield f"data: {json.dumps(error_data)}\n\n"
+            yield _sse_event(error_data)
             return
 
+        ended = False
         try:
             while True:
-                # 从队列中等待一个事件
-                event = await queue.get()
+                # 等待下一个事件，None 表示任务已结束且事件已全部发送
+                event = await _next_writing_event(session)
                 if event is None:
-                    # None 是结束信号
+                    ended = True
                     break
-                yield f"data: {json.dumps(event)}\n\n"
+                yield _sse_event(event)
+            task = session.task
+            if not task.cancelled() and (e := task.exception()) is not None:
+                error_data = {"type": "error", "data": f"写作 Agent 执行出错: {e}"}
+                yield _sse_event(error_data)
+            yield _sse_event({"type": "end", "data": "写作任务流结束"})
         except asyncio.CancelledError:
             # 当客户端断开连接时，会触发此异常
-            print(f"客户端断开连接，停止为项目 {project_id} 发送事件。")
+            logger.info("客户端断开连接，停止为项目 %s 发送事件。", project_id)
         finally:
-            # 清理资源
-            if project_id in writing_tasks:
-                del writing_tasks[project_id]
-            if project_id in writing_event_queues:
-                del writing_event_queues[project_id]
+            # 事件全部发送后立即清理；否则保留到任务结束后的宽限期，
+            # 既防止重复启动写作，客户端也可以重新连接继续接收
+            if ended:
+                _discard_writing_session(project_id, session)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
 @app.get("/api/projects/{project_id}/write/current_chapter_index", response_model=int)
-async def get_current_writing_chapter_index(project_id: str):
+async def get_current_writing_chapter_index(project_id: ProjectId):
     """
     获取当前正在写作的章节索引。
     """
@@ -1,15 +1,154 @@
-from openai import AsyncOpenAI
+import asyncio
+from collections import OrderedDict
+import hashlib
+import weakref
+from openai import AsyncOpenAI, BadRequestError, UnprocessableEntityError
 from config import config
 
-openai = AsyncOpenAI(
-    base_url=config.vector_base_url,
-    api_key=config.vector_api_key,
+BATCH_DELAY = 0.005
+"""
+合并 embedding 请求时等待更多请求到来的时间，单位为秒
+"""
+
+MAX_BATCH_SIZE = 256
+"""
+单次 embedding 请求最多包含的文本数，达到后立即发送
+"""
+
+VECTOR_CACHE_SIZE = 1024
+"""
+向量缓存最多保存的条目数
+"""
+
+
+class _Embedder:
+    """
+    某个事件循环上的 embedding 客户端
+
+    同一时间窗口内的多次 generate_vector 调用（例如 agent 一次并发调用多个工具）
+    会被合并为一次 embedding 请求，只需一次网络往返
+    """
+
+    def __init__(self):
+        # 不持有事件循环的引用，否则 _embedders 中的弱引用键永远不会被释放
+        self.client = AsyncOpenAI(
+            base_url=config.vector_base_url,
+            api_key=config.vector_api_key,
+        )
+        self.pending: list[tuple[str, asyncio.Future[list[float]]]] = []
+        """
+        等待发送的文本及其结果
+        """
+        self.flush_handle: asyncio.TimerHandle | None = None
+        """
+        已安排的发送定时器
+        """
+        self.requests: set[asyncio.Task[None]] = set()
+        """
+        正在进行的请求，持有引用防止被回收
+        """
+
+    def embed(self, text: str) -> asyncio.Future[list[float]]:
+        """
+        将文本加入待发送的批次，返回其向量的 Future
+        """
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[list[float]] = loop.create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= MAX_BATCH_SIZE:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(BATCH_DELAY, self.flush)
+        return future
+
+    def flush(self):
+        """
+        立即发送当前批次
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self.send(batch))
+            self.requests.add(task)
+            task.add_done_callback(self.requests.discard)
+
+    async def send(self, batch: list[tuple[str, asyncio.Future[list[float]]]]):
+        """
+        以一次请求生成整个批次的向量，并分发给各自的调用者
+
+        请求因输入被拒绝而失败时将批次拆成两半分别重试，直到定位到失败的单个文本，
+        一个无法处理的文本不会让同批次其他调用者的请求一起失败；
+        其他错误直接让整个批次失败
+        """
+        try:
+            response = await self.client.embeddings.create(
+                model=config.vector_model,
+                input=[text for text, _ in batch],
+            )
+        except Exception as e:
+            # 只有输入本身被拒绝时才拆分重试，定位出有问题的文本；
+            # 连接错误、超时、限流和服务端错误与输入无关，拆分只会放大请求量
+            rejected = isinstance(e, (BadRequestError, UnprocessableEntityError))
+            if rejected and len(batch) > 1:
+                middle = len(batch) // 2
+                await asyncio.gather(
+                    self.send(batch[:middle]), self.send(batch[middle:])
+                )
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for item in response.data:
+            future = batch[item.index][1]
+            if not future.done():
+                future.set_result(item.embedding)
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(ValueError("embedding 响应中缺少结果"))
+
+
+_embedders: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Embedder]" = (
+    weakref.WeakKeyDictionary()
 )
+"""
+每个事件循环各自的 embedding 客户端
+
+客户端内部的连接池绑定在首次使用它的事件循环上，不能跨循环共享，
+事件循环被回收后对应的客户端也随之释放
+"""
+
+
+def _get_embedder() -> _Embedder:
+    """
+    获取当前事件循环的 embedding 客户端，不存在时创建
+    """
+    loop = asyncio.get_running_loop()
+    embedder = _embedders.get(loop)
+    if embedder is None:
+        embedder = _Embedder()
+        _embedders[loop] = embedder
+    return embedder
+
+
+_vector_cache: OrderedDict[bytes, list[float]] = OrderedDict()
+"""
+文本向量的 LRU 缓存，键为文本内容的摘要
+
+替换属性未变的实体或边时，无需再次请求 embedding
+"""
 
 
 async def generate_vector(text: str) -> list[float] | None:
-    response = await openai.embeddings.create(
-        model=config.vector_model,
-        input=[text],
-    )
-    return response.data[0].embedding
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    cached = _vector_cache.get(key)
+    if cached is not None:
+        _vector_cache.move_to_end(key)
+        return cached
+    result = await _get_embedder().embed(text)
+    _vector_cache[key] = result
+    if len(_vector_cache) > VECTOR_CACHE_SIZE:
+        _vector_cache.popitem(last=False)
+    return result
@@ -1,16 +1,26 @@
+import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from enum import IntEnum, unique
+import logging
 from os import path
 import pickle
-from typing import TypeAlias
+from typing import Literal, TypeAlias
 from uuid import UUID, uuid4
-import aiofiles
 import networkx
 from qdrant_client import AsyncQdrantClient, models
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client.http.models import (
+    Distance,
+    ExtendedPointId,
+    PointStruct,
+    VectorParams,
+)
+from fs_utils import write_bytes
 import vector
 from config import config
 
+logger = logging.getLogger("plotweave.world")
+
 
 @unique
 class EntityType(IntEnum):
@@ -29,24 +39,27 @@ class EntityType(IntEnum):
     ORGANIZATION = 3  # pyright: ignore[reportCallIssue]
 
     def __str__(self):
-        match self:
-            case EntityType.PERSON:
-                return "人物"
-            case EntityType.PLACE:
-                return "地点"
-            case EntityType.ITEM:
-                return "物品"
-            case EntityType.ORGANIZATION:
-                return "组织"
+        return _ENTITY_TYPE_NAMES[self]
 
-    def __hash__(self):
-        return hash(self.value)
+    # 直接使用 int 的 C 实现，与对应整数的哈希一致
+    __hash__ = int.__hash__
 
 
-@dataclass
+_ENTITY_TYPE_NAMES: dict[EntityType, str] = {
+    EntityType.PERSON: "人物",
+    EntityType.PLACE: "地点",
+    EntityType.ITEM: "物品",
+    EntityType.ORGANIZATION: "组织",
+}
+"""
+实体类型的中文名称
+"""
+
+
+@dataclass(frozen=True)
 class AttributeValue:
     """
-    属性值
+    属性值，创建后不可修改
 
     - value: 属性值
     - timestamp_desc: 本属性值开始生效的时间描述
@@ -55,9 +68,6 @@ class AttributeValue:
     value: str
     timestamp_desc: str
 
-    def __hash__(self):
-        return hash((self.value, self.timestamp_desc))
-
 
 @dataclass
 class Entity:
@@ -123,12 +133,14 @@ class SearchResultEntity:
     - type: 实体类型
     - attributes: 属性信息
     - score: 相似度分数，数值越大表示越相似
+    - kind: 固定为 "entity"
     """
 
     id: str
     type: str
     attributes: dict[str, list[AttributeValue]]
     score: float
+    kind: Literal["entity"] = field(default="entity", init=False)
 
 
 @dataclass
@@ -141,6 +153,7 @@ class SearchResultEdge:
     - to_entity_id: 终点实体的唯一标识符
     - attributes: 属性信息
     - score: 相似度分数，数值越大表示越相似
+    - kind: 固定为 "edge"
     """
 
     id: str
@@ -148,11 +161,103 @@ class SearchResultEdge:
     to_entity_id: str
     attributes: dict[str, list[AttributeValue]]
     score: float
+    kind: Literal["edge"] = field(default="edge", init=False)
 
 
 SearchResult: TypeAlias = SearchResultEntity | SearchResultEdge
 """搜索结果，可能是实体也可能是边"""
 
+SEARCH_CACHE_SIZE = 128
+"""搜索结果缓存的最大条目数"""
+
+UPSERT_BATCH_SIZE = 32
+"""
+待写入向量数据库的点积累到此数量时立即批量写入
+"""
+
+
+def _attributes_str(title: str, attributes: dict[str, list[AttributeValue]]) -> str:
+    """
+    将属性信息格式化为用于生成向量的文本
+
+    各部分先收集到一个列表中，最后只拼接一次
+    """
+    parts = [title, "：\n"]
+    append = parts.append
+    for key, values in attributes.items():
+        append(key)
+        append("：")
+        append(", ".join([f"{av.value} ({av.timestamp_desc})" for av in values]))
+        append("\n")
+    if not attributes:
+        append("\n")
+    return "".join(parts)
+
+
+def _attributes_payload(
+    attributes: dict[str, list[AttributeValue]],
+) -> dict[str, list[dict[str, str]]]:
+    """
+    将属性信息转换为向量数据库中的 payload
+    """
+    return {
+        key: [{"value": av.value, "timestamp_desc": av.timestamp_desc} for av in values]
+        for key, values in attributes.items()
+    }
+
+
+def _parse_attributes(
+    attributes_payload: dict[str, list[dict[str, str]]],
+) -> dict[str, list[AttributeValue]]:
+    """
+    将向量数据库 payload 中的属性信息还原为属性值列表，_attributes_payload 的逆操作
+    """
+    return {
+        key: [AttributeValue(av["value"], av["timestamp_desc"]) for av in values]
+        for key, values in attributes_payload.items()
+    }
+
+
+def _entity_point(entity: Entity, entity_vector: list[float]) -> PointStruct:
+    """
+    构造实体在向量数据库中的点
+    """
+    return PointStruct(
+        id=str(entity.id),
+        vector=entity_vector,
+        payload={
+            "type": str(entity.type),
+            "attributes": _attributes_payload(entity.attributes),
+        },
+    )
+
+
+def _edge_point(
+    edge: Edge, from_entity_id: UUID, to_entity_id: UUID, edge_vector: list[float]
+) -> PointStruct:
+    """
+    构造边在向量数据库中的点
+    """
+    return PointStruct(
+        id=str(edge.id),
+        vector=edge_vector,
+        payload={
+            "type": "边",
+            "from_entity_id": str(from_entity_id),
+            "to_entity_id": str(to_entity_id),
+            "attributes": _attributes_payload(edge.attributes),
+        },
+    )
+
+
+async def _generate_vectors(texts: list[str]) -> list[list[float] | None]:
+    """
+    并发生成多段文本的向量
+
+    同时发起的请求会被 vector 模块合并为一次 embedding 请求
+    """
+    return await asyncio.gather(*(vector.generate_vector(text) for text in texts))
+
 
 class World:
     def __init__(self, persistent_path: str | None = None):
@@ -172,37 +277,174 @@ class World:
             self.client = AsyncQdrantClient(path=qdrant_location)
             self.graph_location = path.abspath(persistent_path) + "/graph.pkl"
 
-        if self.graph_location is None:
-            self.graph: networkx.MultiDiGraph[UUID] = networkx.MultiDiGraph()
-        else:
+        # 持久化的图在 initialize 中于线程池里加载，避免反序列化阻塞事件循环
+        self.graph: networkx.MultiDiGraph[UUID] = networkx.MultiDiGraph()
+
+        self._edge_index: dict[UUID, tuple[UUID, UUID]] = {}
+        """
+        边ID到 (起点实体ID, 终点实体ID) 的索引，用于按ID直接定位边
+        """
+
+        self._version = 0
+        """
+        世界状态的版本号，每次修改后递增
+        """
+
+        self._synced_version = 0
+        """
+        最近一次同步到磁盘时的版本号
+        """
+
+        self._search_cache: OrderedDict[tuple[str, int], list[SearchResult]] = (
+            OrderedDict()
+        )
+        """
+        搜索结果的 LRU 缓存，键为 (查询字符串, 结果数量上限)，世界状态变更时清空
+        """
+
+        self._pending_points: dict[ExtendedPointId, PointStruct] = {}
+        """
+        尚未写入向量数据库的点，键为点 ID，同一点多次修改时只保留最新的
+        """
+
+        self._flush_lock = asyncio.Lock()
+        """
+        保证批量写入按顺序进行，后排队的修改不会被先排队的覆盖
+        """
+
+    @property
+    def is_dirty(self) -> bool:
+        """
+        自上次同步到磁盘以来，世界状态是否被修改过
+        """
+        return self._version != self._synced_version
+
+    def _mark_changed(self):
+        """
+        记录一次世界状态变更，并使搜索缓存失效
+        """
+        self._version += 1
+        self._search_cache.clear()
+
+    async def _queue_upsert(self, point: PointStruct):
+        """
+        将一个点加入待写入队列，积累到 UPSERT_BATCH_SIZE 个时批量写入
+        """
+        self._pending_points[point.id] = point
+        await self._flush_if_full()
+
+    async def _flush_if_full(self):
+        """
+        待写入的点达到 UPSERT_BATCH_SIZE 个时批量写入
+        """
+        if len(self._pending_points) >= UPSERT_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        """
+        将所有待写入的点以一次 upsert 写入向量数据库
+
+        搜索、删除、同步到磁盘和关闭之前都会先调用，保证读到的是最新状态
+        """
+        async with self._flush_lock:
+            if not self._pending_points:
+                return
+            points = self._pending_points
+            self._pending_points = {}
             try:
-                self.graph: networkx.MultiDiGraph[UUID] = load_graph_from_file(
-                    file_path=self.graph_location
+                await self.client.upsert(
+                    collection_name="world",
+                    points=list(points.values()),
                 )
-            except GraphLoadError:
-                self.graph = networkx.MultiDiGraph()
+            except Exception:
+                # 写入失败，放回队列等待下次重试，期间更新过的点以新的为准
+                for point_id, point in points.items():
+                    self._pending_points.setdefault(point_id, point)
+                raise
 
     async def close(self):
         """
         关闭并释放资源，例如数据库连接。
         """
+        await self.flush()
         await self.client.close()
 
     async def initialize(self):
         """
         初始化一些异步资源，必须在创建之后尽早调用
         """
+        if self.graph_location is not None:
+            try:
+                self.graph = await asyncio.to_thread(
+                    load_graph_from_file, self.graph_location
+                )
+            except GraphLoadError:
+                self.graph = networkx.MultiDiGraph()
+            self._edge_index = {
+                key: (u, v) for u, v, key in self.graph.edges(keys=True)
+            }
+
+        vectors_config = VectorParams(
+            size=config.vector_dimension, distance=Distance.COSINE
+        )
         try:
             # 尝试获取集合信息，如果不存在会抛出异常
-            await self.client.get_collection(collection_name="world")
+            info = await self.client.get_collection(collection_name="world")
         except Exception:
             # 捕获异常（意味着集合不存在），然后创建它
-            await self.client.recreate_collection(
-                collection_name="world",
-                vectors_config=VectorParams(
-                    size=config.vector_dimension, distance=Distance.COSINE
-                ),
+            await self.client.create_collection(
+                collection_name="world", vectors_config=vectors_config
             )
+            return
+        vectors = info.config.params.vectors
+        if (
+            isinstance(vectors, VectorParams)
+            and vectors.size == config.vector_dimension
+        ):
+            # 已有集合与当前配置一致，直接复用其中的向量
+            return
+        # 向量维度变化（例如更换了 embedding 模型），已有的向量无法再使用，
+        # 先用新模型为图中所有实体和边重新生成向量，全部成功后才替换集合
+        try:
+            points = await self._graph_points()
+        except Exception:
+            logger.exception(
+                "向量维度已变化，但无法重新生成现有实体和边的向量，保留原有集合: %s",
+                self.graph_location,
+            )
+            return
+        await self.client.delete_collection(collection_name="world")
+        await self.client.create_collection(
+            collection_name="world", vectors_config=vectors_config
+        )
+        for point in points:
+            self._pending_points[point.id] = point
+        await self.flush()
+
+    async def _graph_points(self) -> list[PointStruct]:
+        """
+        为图中所有实体和边生成向量数据库中的点，任一向量生成失败时抛出异常
+        """
+        entities: list[Entity] = [
+            entity for _, entity in self.graph.nodes(data="entity") if entity
+        ]
+        edges: list[tuple[UUID, UUID, Edge]] = [
+            (u, v, edge) for u, v, edge in self.graph.edges(data="edge") if edge
+        ]
+        vectors = await _generate_vectors(
+            [_attributes_str("实体属性", entity.attributes) for entity in entities]
+            + [_attributes_str("边属性", edge.attributes) for _, _, edge in edges]
+        )
+        points: list[PointStruct] = []
+        for entity, entity_vector in zip(entities, vectors[: len(entities)]):
+            if entity_vector is None:
+                raise ValueError("Failed to generate vector for entity.")
+            points.append(_entity_point(entity, entity_vector))
+        for (u, v, edge), edge_vector in zip(edges, vectors[len(entities) :]):
+            if edge_vector is None:
+                raise ValueError("Failed to generate vector for edge.")
+            points.append(_edge_point(edge, u, v, edge_vector))
+        return points
 
     async def add_entity(self, entity: Entity):
         """
@@ -212,39 +454,40 @@ class World:
 
         如果实体已存在则抛出异常
         """
-        if entity.id in self.graph:
-            raise ValueError(f"Entity with id {entity.id} already exists.")
-        self.graph.add_node(entity.id, entity=entity)
-        entity_attributes_str = "\n".join(
-            f"{key}：{', '.join(f'{av.value} ({av.timestamp_desc})' for av in values)}"
-            for key, values in entity.attributes.items()
-        )
-        entity_str = f"""实体属性：
-{entity_attributes_str}
-"""
-        entity_vector = await vector.generate_vector(entity_str)
-        if entity_vector is None:
-            raise ValueError("Failed to generate vector for entity.")
-        attributes_payload = {
-            key: [
-                {"value": av.value, "timestamp_desc": av.timestamp_desc}
-                for av in values
-            ]
-            for key, values in entity.attributes.items()
-        }
-        point = PointStruct(
-            id=str(entity.id),
-            vector=entity_vector,
-            payload={
-                "id": str(entity.id),
-                "type": str(entity.type),
-                "attributes": attributes_payload,
-            },
-        )
-        await self.client.upsert(
-            collection_name="world",
-            points=[point],
+        await self.add_entities([entity])
+
+    async def add_entities(self, entities: list[Entity]):
+        """
+        批量添加实体
+
+        - entities: 实体对象列表
+
+        所有实体的向量并发生成，并一起写入向量数据库。
+        如果任一实体已存在（或列表中有重复的ID）则抛出异常，不添加任何实体
+        """
+        ids: set[UUID] = set()
+        for entity in entities:
+            if entity.id in self.graph or entity.id in ids:
+                raise ValueError(f"Entity with id {entity.id} already exists.")
+            ids.add(entity.id)
+        # 先生成全部向量再修改图，任一向量生成失败时图和向量数据库都保持不变
+        entity_vectors = await _generate_vectors(
+            [_attributes_str("实体属性", entity.attributes) for entity in entities]
         )
+        points: list[PointStruct] = []
+        for entity, entity_vector in zip(entities, entity_vectors):
+            if entity_vector is None:
+                raise ValueError("Failed to generate vector for entity.")
+            points.append(_entity_point(entity, entity_vector))
+        # 等待向量期间可能有同ID的实体被并发添加
+        for entity in entities:
+            if entity.id in self.graph:
+                raise ValueError(f"Entity with id {entity.id} already exists.")
+        for entity, point in zip(entities, points):
+            self.graph.add_node(entity.id, entity=entity)
+            self._pending_points[point.id] = point
+        self._mark_changed()
+        await self._flush_if_full()
 
     async def add_edge(self, from_entity_id: UUID, to_entity_id: UUID, edge: Edge):
         """
@@ -256,44 +499,47 @@ class World:
 
         如果边已存在，或者起点或终点实体不存在则抛出异常
         """
-        if from_entity_id not in self.graph or to_entity_id not in self.graph:
-            raise ValueError("Both entities must exist in the graph.")
-        if edge.id in self.graph:
-            raise ValueError(f"Edge with id {edge.id} already exists.")
-        self.graph.add_edge(from_entity_id, to_entity_id, key=edge.id, edge=edge)
-        edge_attributes_str = "\n".join(
-            f"{key}：{', '.join(f'{av.value} ({av.timestamp_desc})' for av in values)}"
-            for key, values in edge.attributes.items()
-        )
-        edge_str = f"""边属性：
-{edge_attributes_str}
-"""
-        edge_vector = await vector.generate_vector(edge_str)
-        if edge_vector is None:
-            raise ValueError("Failed to generate vector for edge.")
-        attributes_payload = {
-            key: [
-                {"value": av.value, "timestamp_desc": av.timestamp_desc}
-                for av in values
-            ]
-            for key, values in edge.attributes.items()
-        }
-
-        point = PointStruct(
-            id=str(edge.id),
-            vector=edge_vector,
-            payload={
-                "id": str(edge.id),
-                "type": "边",
-                "from_entity_id": str(from_entity_id),
-                "to_entity_id": str(to_entity_id),
-                "attributes": attributes_payload,
-            },
-        )
-        await self.client.upsert(
-            collection_name="world",
-            points=[point],
+        await self.add_edges([(from_entity_id, to_entity_id, edge)])
+
+    async def add_edges(self, edges: list[tuple[UUID, UUID, Edge]]):
+        """
+        批量添加边
+
+        - edges: (起点实体ID, 终点实体ID, 边对象) 列表
+
+        所有边的向量并发生成，并一起写入向量数据库。
+        如果任一边已存在，或者其起点或终点实体不存在则抛出异常，不添加任何边
+        """
+        ids: set[UUID] = set()
+        for from_entity_id, to_entity_id, edge in edges:
+            if from_entity_id not in self.graph or to_entity_id not in self.graph:
+                raise ValueError("Both entities must exist in the graph.")
+            if edge.id in self._edge_index or edge.id in ids:
+                raise ValueError(f"Edge with id {edge.id} already exists.")
+            ids.add(edge.id)
+        # 先生成全部向量再修改图，任一向量生成失败时图和向量数据库都保持不变
+        edge_vectors = await _generate_vectors(
+            [_attributes_str("边属性", edge.attributes) for _, _, edge in edges]
         )
+        points: list[PointStruct] = []
+        for (from_entity_id, to_entity_id, edge), edge_vector in zip(
+            edges, edge_vectors
+        ):
+            if edge_vector is None:
+                raise ValueError("Failed to generate vector for edge.")
+            points.append(_edge_point(edge, from_entity_id, to_entity_id, edge_vector))
+        # 等待向量期间端点实体可能已被删除，或有同ID的边被并发添加
+        for from_entity_id, to_entity_id, edge in edges:
+            if from_entity_id not in self.graph or to_entity_id not in self.graph:
+                raise ValueError("Both entities must exist in the graph.")
+            if edge.id in self._edge_index:
+                raise ValueError(f"Edge with id {edge.id} already exists.")
+        for (from_entity_id, to_entity_id, edge), point in zip(edges, points):
+            self.graph.add_edge(from_entity_id, to_entity_id, key=edge.id, edge=edge)
+            self._edge_index[edge.id] = (from_entity_id, to_entity_id)
+            self._pending_points[point.id] = point
+        self._mark_changed()
+        await self._flush_if_full()
 
     async def search(self, query: str, limit: int = 5) -> list[SearchResult]:
         """
@@ -304,54 +550,52 @@ class World:
 
         返回搜索结果列表，包含实体和边
         """
+        cache_key = (query, limit)
+        cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            self._search_cache.move_to_end(cache_key)
+            return list(cached)
+        version = self._version
+
         query_vector = await vector.generate_vector(query)
         if query_vector is None:
             raise ValueError("Failed to generate vector for query.")
-        search_result = await self.client.search(
+        await self.flush()
+        search_result = await self.client.query_points(
             collection_name="world",
+            query=query_vector,
             limit=limit,
-            query_vector=query_vector,
             with_payload=True,
         )
         # 解析搜索结果
         results: list[SearchResult] = []
-        for point in search_result:
+        for point in search_result.points:
             payload = point.payload
             if payload is None:
                 raise ValueError("Search result payload is None. Borken data?")
-            if payload.get("type") == "边":
+            if payload["type"] == "边":
                 result = SearchResultEdge(
-                    id=payload["id"],
+                    id=str(point.id),
                     from_entity_id=payload["from_entity_id"],
                     to_entity_id=payload["to_entity_id"],
-                    attributes={
-                        key: [
-                            AttributeValue(
-                                value=av["value"], timestamp_desc=av["timestamp_desc"]
-                            )
-                            for av in values
-                        ]
-                        for key, values in payload.get("attributes", {}).items()
-                    },
+                    attributes=_parse_attributes(payload["attributes"]),
                     score=point.score,
                 )
             else:
                 result = SearchResultEntity(
-                    id=payload["id"],
+                    id=str(point.id),
                     type=payload["type"],
-                    attributes={
-                        key: [
-                            AttributeValue(
-                                value=av["value"], timestamp_desc=av["timestamp_desc"]
-                            )
-                            for av in values
-                        ]
-                        for key, values in payload.get("attributes", {}).items()
-                    },
+                    attributes=_parse_attributes(payload["attributes"]),
                     score=point.score,
                 )
             results.append(result)
-        return results
+
+        # 搜索期间世界可能已被修改，此时结果可能已过期，不放入缓存
+        if version == self._version:
+            self._search_cache[cache_key] = results
+            if len(self._search_cache) > SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+        return list(results)
 
     def get_entity(self, entity_id: UUID) -> Entity | None:
         """
@@ -374,10 +618,10 @@ class World:
 
         如果边不存在则返回None
         """
-        for _, _, key, edge_data in self.graph.edges(data=True, keys=True):
-            if key == edge_id:
-                return edge_data.get("edge")
-        return None
+        uv = self._edge_index.get(edge_id)
+        if uv is None:
+            return None
+        return self.graph[uv[0]][uv[1]][edge_id].get("edge")
 
     async def delete_entity(self, entity_id: UUID) -> bool:
         """
@@ -389,42 +633,35 @@ class World:
         """
         if entity_id not in self.graph:
             return False
+        # 先写入排队中的点，避免删除之后它们又被写回
+        await self.flush()
+        for _, _, key in self.graph.in_edges(entity_id, keys=True):
+            self._edge_index.pop(key, None)
+        for _, _, key in self.graph.out_edges(entity_id, keys=True):
+            self._edge_index.pop(key, None)
         self.graph.remove_node(entity_id)
-        # 删除向量数据库中的该实体
-        await self.client.delete(
-            collection_name="world", points_selector=[str(entity_id)], wait=True
-        )
-        # 删除所有from_entity_id等于指定实体ID的边
+        # 以一次请求删除向量数据库中的该实体，以及所有以其为起点或终点的边
+        entity_id_str = str(entity_id)
         await self.client.delete(
             collection_name="world",
             points_selector=models.FilterSelector(
                 filter=models.Filter(
-                    must=[
+                    should=[
+                        models.HasIdCondition(has_id=[entity_id_str]),
                         models.FieldCondition(
                             key="from_entity_id",
-                            match=models.MatchValue(value=str(entity_id)),
-                        )
-                    ]
-                )
-            ),
-            wait=True,
-        )
-
-        # 删除所有to_entity_id等于指定实体ID的边
-        await self.client.delete(
-            collection_name="world",
-            points_selector=models.FilterSelector(
-                filter=models.Filter(
-                    must=[
+                            match=models.MatchValue(value=entity_id_str),
+                        ),
                         models.FieldCondition(
                             key="to_entity_id",
-                            match=models.MatchValue(value=str(entity_id)),
-                        )
+                            match=models.MatchValue(value=entity_id_str),
+                        ),
                     ]
                 )
             ),
             wait=True,
         )
+        self._mark_changed()
         return True
 
     async def replace_entity(self, entity: Entity) -> bool:
@@ -438,36 +675,14 @@ class World:
         if entity.id not in self.graph:
             return False
         self.graph.nodes[entity.id]["entity"] = entity
-        entity_attributes_str = "\n".join(
-            f"{key}：{', '.join(f'{av.value} ({av.timestamp_desc})' for av in values)}"
-            for key, values in entity.attributes.items()
+        entity_vector = await vector.generate_vector(
+            _attributes_str("实体属性", entity.attributes)
         )
-        entity_str = f"""实体属性：
-{entity_attributes_str}
-"""
-        entity_vector = await vector.generate_vector(entity_str)
         if entity_vector is None:
             raise ValueError("Failed to generate vector for entity.")
-        attributes_payload = {
-            key: [
-                {"value": av.value, "timestamp_desc": av.timestamp_desc}
-                for av in values
-            ]
-            for key, values in entity.attributes.items()
-        }
-        point = PointStruct(
-            id=str(entity.id),
-            vector=entity_vector,
-            payload={
-                "id": str(entity.id),
-                "type": str(entity.type),
-                "attributes": attributes_payload,
-            },
-        )
-        await self.client.upsert(
-            collection_name="world",
-            points=[point],
-        )
+        point = _entity_point(entity, entity_vector)
+        await self._queue_upsert(point)
+        self._mark_changed()
         return True
 
     async def replace_edge(self, edge: Edge) -> bool:
@@ -478,43 +693,20 @@ class World:
 
         返回True表示替换成功，False表示边不存在
         """
-        for u, v, key in list(self.graph.edges(keys=True)):
-            if key == edge.id:
-                self.graph[u][v][key]["edge"] = edge
-                edge_attributes_str = "\n".join(
-                    f"{key}：{', '.join(f'{av.value} ({av.timestamp_desc})' for av in values)}"
-                    for key, values in edge.attributes.items()
-                )
-                edge_str = f"""边属性：
-{edge_attributes_str}
-"""
-                edge_vector = await vector.generate_vector(edge_str)
-                if edge_vector is None:
-                    raise ValueError("Failed to generate vector for edge.")
-                attributes_payload = {
-                    key: [
-                        {"value": av.value, "timestamp_desc": av.timestamp_desc}
-                        for av in values
-                    ]
-                    for key, values in edge.attributes.items()
-                }
-                point = PointStruct(
-                    id=str(edge.id),
-                    vector=edge_vector,
-                    payload={
-                        "id": str(edge.id),
-                        "type": "边",
-                        "from_entity_id": str(edge.from_entity_id),
-                        "to_entity_id": str(edge.to_entity_id),
-                        "attributes": attributes_payload,
-                    },
-                )
-                await self.client.upsert(
-                    collection_name="world",
-                    points=[point],
-                )
-                return True
-        return False
+        uv = self._edge_index.get(edge.id)
+        if uv is None:
+            return False
+        u, v = uv
+        self.graph[u][v][edge.id]["edge"] = edge
+        edge_vector = await vector.generate_vector(
+            _attributes_str("边属性", edge.attributes)
+        )
+        if edge_vector is None:
+            raise ValueError("Failed to generate vector for edge.")
+        point = _edge_point(edge, edge.from_entity_id, edge.to_entity_id, edge_vector)
+        await self._queue_upsert(point)
+        self._mark_changed()
+        return True
 
     async def delete_edge(self, edge_id: UUID) -> bool:
         """
@@ -524,18 +716,20 @@ class World:
 
         返回True表示删除成功，False表示边不存在
         """
-        for u, v, key in list(self.graph.edges(keys=True)):
-            if key == edge_id:
-                self.graph.remove_edge(u, v, key=edge_id)
-                # 删除向量数据库中的该边
-                await self.client.delete(
-                    collection_name="world",
-                    points_selector=[str(edge_id)],
-                    wait=True,
-                )
-
-                return True
-        return False
+        uv = self._edge_index.pop(edge_id, None)
+        if uv is None:
+            return False
+        self.graph.remove_edge(uv[0], uv[1], key=edge_id)
+        # 先写入排队中的点，避免删除之后它们又被写回
+        await self.flush()
+        # 删除向量数据库中的该边
+        await self.client.delete(
+            collection_name="world",
+            points_selector=[str(edge_id)],
+            wait=True,
+        )
+        self._mark_changed()
+        return True
 
     def get_related_edges(
         self, entity_id: UUID
@@ -551,29 +745,38 @@ class World:
         if entity_id not in self.graph:
             return None
 
-        # 使用 set 来自动处理重复的边（例如自环）
-        found_edges: set[tuple[Entity, Edge, Entity]] = set()
+        # 所有边的一端都是该实体本身，只需查找一次
+        entity = self.get_entity(entity_id)
+        if entity is None:
+            return []
+
+        # 以边ID去重（例如自环会同时出现在出边和入边中），
+        # 无需对整个 (实体, 边, 实体) 元组求哈希和比较
+        found_edges: dict[UUID, tuple[Entity, Edge, Entity]] = {}
 
         # 获取所有出边 (entity -> neighbor)
-        for u, v, _, edge_data in self.graph.out_edges(entity_id, data=True, keys=True):
+        for _, v, key, edge_data in self.graph.out_edges(
+            entity_id, data=True, keys=True
+        ):
             edge = edge_data.get("edge")
             if edge:
-                # 这里的 u, v 分别是起点和终点的 ID
-                start_entity = self.get_entity(u)
                 end_entity = self.get_entity(v)
-                if start_entity and end_entity:
-                    found_edges.add((start_entity, edge, end_entity))
-
-        # 获取所有入边 (predecessor -> entity)
-        for u, v, _, edge_data in self.graph.in_edges(entity_id, data=True, keys=True):
+                if end_entity:
+                    found_edges[key] = (entity, edge, end_entity)
+
+        # 获取所有入边 (predecessor -> entity)，自环已在出边中处理过
+        for u, _, key, edge_data in self.graph.in_edges(
+            entity_id, data=True, keys=True
+        ):
+            if key in found_edges:
+                continue
             edge = edge_data.get("edge")
             if edge:
                 start_entity = self.get_entity(u)
-                end_entity = self.get_entity(v)
-                if start_entity and end_entity:
-                    found_edges.add((start_entity, edge, end_entity))
+                if start_entity:
+                    found_edges[key] = (start_entity, edge, entity)
 
-        return list(found_edges)
+        return list(found_edges.values())
 
     def get_edges_between(
         self, from_entity_id: UUID, to_entity_id: UUID
@@ -597,6 +800,23 @@ class World:
                 edges.append(edge)
         return edges
 
+    def _entity_labels(self) -> dict[UUID, tuple[str | None, EntityType]]:
+        """
+        一次遍历所有实体，返回 {实体ID: (最新的名字, 实体类型)}，没有名字时为 None
+
+        供 __str__ 和 to_mermaid 生成可读的标签
+        """
+        labels: dict[UUID, tuple[str | None, EntityType]] = {}
+        for entity_id, entity in self.graph.nodes(data="entity"):
+            if not entity:
+                continue
+            name_values = entity.attributes.get("名字")
+            labels[entity_id] = (
+                name_values[-1].value if name_values else None,
+                entity.type,
+            )
+        return labels
+
     def __str__(self):
         """
         为 World 对象提供一个易于阅读的字符串表示形式，用于调试。
@@ -617,20 +837,12 @@ class World:
         # 1. 遍历并展示实体摘要
         lines.append("Entities:")
         id_to_name_map: dict[UUID, str] = {}
-        for entity_id, data in self.graph.nodes(data=True):
-            entity = data.get("entity")
-            if not entity:
-                continue
-
-            # 尝试从属性中获取一个可读的名称，否则回退到ID
-            name_values = entity.attributes.get("名字")
-            if name_values:
-                # 使用最新的名字
-                name = name_values[-1].value
-                entity_repr = f"{name} ({entity.type})"
+        for entity_id, (name, entity_type) in self._entity_labels().items():
+            if name is not None:
+                entity_repr = f"{name} ({entity_type})"
                 id_to_name_map[entity_id] = name
             else:
-                entity_repr = f"{entity.type} (ID: {str(entity_id)[:8]})"
+                entity_repr = f"{entity_type} (ID: {str(entity_id)[:8]})"
                 id_to_name_map[entity_id] = f"ID:{str(entity_id)[:8]}"
 
             lines.append(f"  - {entity_repr:<40} | ID: {entity_id}")
@@ -673,25 +885,20 @@ class World:
 
         # --- 1. 定义所有节点 (实体) ---
         lines.append("\n    %% Entities")
-        for entity_id, data in self.graph.nodes(data=True):
-            entity = data.get("entity")
-            if not entity:
-                continue
-
-            # Mermaid的节点ID不能有-，我们进行替换
-            node_id = f"E_{str(entity_id).replace('-', '')}"
+        for entity_id, (name, entity_type) in self._entity_labels().items():
+            # Mermaid的节点ID不能有-，使用不带连字符的十六进制形式
+            node_id = f"E_{entity_id.hex}"
             uuid_to_node_id[entity_id] = node_id
 
             # 获取节点显示名
-            name_values = entity.attributes.get("名字")
-            if name_values:
+            if name is not None:
                 # Mermaid标签内的引号需要转义
-                label_text = name_values[-1].value.replace('"', "#quot;")
+                label_text = name.replace('"', "#quot;")
             else:
                 label_text = f"ID:{str(entity_id)[:8]}"
 
             # 生成节点定义，格式：NodeID["显示文本(类型)"]
-            lines.append(f'    {node_id}["{label_text} ({entity.type})"]')
+            lines.append(f'    {node_id}["{label_text} ({entity_type})"]')
 
         # --- 2. 定义所有链接 (边) ---
         lines.append("\n    %% Edges")
@@ -720,11 +927,17 @@ class World:
     async def sync_to_disk(self):
         """
         将世界状态同步到持久化存储（如果有的话）
+
+        自上次同步以来没有修改时直接跳过
         """
-        if self.graph_location is not None:
-            data = pickle.dumps(self.graph)
-            async with aiofiles.open(self.graph_location, "wb") as f:
-                await f.write(data)
+        await self.flush()
+        if self.graph_location is not None and self.is_dirty:
+            version = self._version
+            # 序列化留在事件循环上进行，保证得到的是图的一致快照：
+            # 工具会在事件循环上原地修改实体和边的属性，放到线程中序列化会与之竞争
+            data = pickle.dumps(self.graph, protocol=pickle.HIGHEST_PROTOCOL)
+            await write_bytes(self.graph_location, data)
+            self._synced_version = version
 
 
 class GraphLoadError(Exception):
@@ -743,8 +956,10 @@ def load_graph_from_file(file_path: str) -> "networkx.MultiDiGraph[UUID]":
     返回加载的图对象。
     """
     try:
+        # 一次读入整个文件再反序列化，比让 pickle 逐段从文件对象读取更快
         with open(file_path, "rb") as f:
-            graph_obj = pickle.load(f)
+            data = f.read()
+        graph_obj = pickle.loads(data)
 
         # 验证加载的对象是不是我们期望的 MultiDiGraph 类型
         if not isinstance(graph_obj, networkx.MultiDiGraph):
@@ -1,19 +1,21 @@
 from enum import Enum
-from typing import Annotated, TypedDict
+from typing import Annotated, Callable, NotRequired, TypedDict
 from uuid import UUID
 from langchain_core.messages import BaseMessage, AIMessage, ToolMessage, HumanMessage
 from langgraph.graph import StateGraph, START, END  # pyright: ignore[reportMissingTypeStubs]
-from langchain.chat_models import init_chat_model
 from agent_tools import world_tools, writer_tools
 from langgraph.prebuilt import ToolNode, InjectedState
 from chapter import ChapterInfo
-from config import config
+from agent import llm
 from project_metadata import ProjectMetadata
 from world import World
 from langchain_core.tools import tool, InjectedToolCallId  # type: ignore
+import logging
 import operator
 from langgraph.types import Command
 
+logger = logging.getLogger("plotweave.writer_agent")
+
 
 class WritingState(str, Enum):
     PLANNING = "计划"
@@ -23,6 +25,16 @@ class WritingState(str, Enum):
     COMPLETE = "完成"
 
 
+def _append_event_line(previous: str, event: str) -> str:
+    """
+    approved_events_str 的归并函数，将新事件追加为列表中的一行
+    """
+    if not event:
+        return previous
+    line = f"- {event}"
+    return f"{previous}\n{line}" if previous else line
+
+
 class State(TypedDict):
     """
     写作agent的状态
@@ -68,9 +80,46 @@ class State(TypedDict):
     已批准的事件列表
     """
 
+    approved_events_str: Annotated[str, _append_event_line]
+    """
+    已批准的事件列表格式化后的文本，每个事件一行，随事件的批准逐行追加
+    """
+
+    last_proposal_index: NotRequired[int]
+    """
+    最近一条提出世界修改的 AI 消息在 messages 中的索引，由 writer_bot 维护
+    """
+
 
 graph_builder = StateGraph(State)
 
+WORLD_MODIFICATION_TOOLS = frozenset(
+    {
+        "add_entity_tool",
+        "update_entity_property_tool",
+        "add_relation_tool",
+    }
+)
+"""
+视为提出世界修改的工具名称
+"""
+
+ALLOWED_TRANSITIONS: dict[WritingState, tuple[frozenset[WritingState], str]] = {
+    WritingState.PROPOSING_CHANGES: (
+        frozenset({WritingState.PLANNING}),
+        "在提议之前必须先进行计划",
+    ),
+    WritingState.FINAL_WRITING: (
+        frozenset({WritingState.PLANNING}),
+        "必须在所有计划完成后才能进入整合写作阶段",
+    ),
+}
+"""
+有前置条件的写作状态，值为 (允许从哪些状态切换而来, 不满足时告诉模型的原因)
+
+不在其中的状态可以从任意状态切换而来
+"""
+
 
 @tool
 def switch_writing_state_tool(
@@ -81,38 +130,36 @@ def switch_writing_state_tool(
     """
     切换写作状态。用于在 '计划', '提议', '整合写作', '完成' 之间切换。
     """
-    print(f"请求切换写作状态到 {state}，当前状态是 {previous_state}")
+    logger.info(
+        "请求切换写作状态到 %s，当前状态是 %s", state.value, previous_state.value
+    )
     if state == previous_state:
-        return Command()
-
-    match state:
-        case WritingState.PROPOSING_CHANGES:
-            if previous_state != WritingState.PLANNING:
-                return Command(
-                    update={
-                        "messages": [
-                            ToolMessage(
-                                tool_call_id=tool_call_id,
-                                content=f"无法从当前状态 {previous_state} 切换到 {state}，在提议之前必须先进行计划",
-                            )
-                        ]
-                    }
-                )
-        case WritingState.FINAL_WRITING:
-            if previous_state != WritingState.PLANNING:
-                return Command(
-                    update={
-                        "messages": [
-                            ToolMessage(
-                                tool_call_id=tool_call_id,
-                                content=f"无法从当前状态 {previous_state} 切换到 {state}，必须在所有计划完成后才能进入整合写作阶段",
-                            )
-                        ]
-                    }
-                )
-        case _:
-            pass
-    print(f"成功切换写作状态到 {state}")
+        # 每个工具调用都必须有对应的 ToolMessage，否则下一次请求模型时会因缺少工具结果而失败
+        return Command(
+            update={
+                "messages": [
+                    ToolMessage(
+                        tool_call_id=tool_call_id, content=f"当前已处于 {state} 状态"
+                    )
+                ]
+            }
+        )
+
+    transition = ALLOWED_TRANSITIONS.get(state)
+    if transition is not None:
+        allowed_previous_states, reason = transition
+        if previous_state not in allowed_previous_states:
+            return Command(
+                update={
+                    "messages": [
+                        ToolMessage(
+                            tool_call_id=tool_call_id,
+                            content=f"无法从当前状态 {previous_state} 切换到 {state}，{reason}",
+                        )
+                    ]
+                }
+            )
+    logger.info("成功切换写作状态到 %s", state.value)
     return Command(
         update={
             "writing_state": state,
@@ -125,12 +172,6 @@ def switch_writing_state_tool(
     )
 
 
-llm = init_chat_model(
-    model=config.writer_model,
-    model_provider="openai",
-    base_url=config.writer_base_url,
-    api_key=config.writer_api_key,
-)
 tools = (
     world_tools.read_and_append_tools
     + writer_tools.full_tools
@@ -141,25 +182,11 @@ llm_with_tools = llm.bind_tools(  # pyright: ignore[reportUnknownMemberType]
 )
 
 
-def build_hint_prompt(
-    state: State,
-) -> str:
+def _planning_hint(chapter_info: ChapterInfo, approved_events_str: str) -> str:
     """
-    构建并返回任务提示语
+    计划阶段的任务提示语
     """
-    writing_state = state["writing_state"]
-    chapter_info = state["current_chapter_info"]
-    approved_events = state.get("approved_events", [])
-
-    approved_events_str = (
-        "\n".join(f"- {event}" for event in approved_events)
-        if approved_events
-        else "无"
-    )
-
-    match writing_state:
-        case WritingState.PLANNING:
-            return f"""章节标题: {chapter_info.title}
+    return f"""章节标题: {chapter_info.title}
 章节意图: {chapter_info.intent}
 
 当前处于小说写作的【计划阶段】。
@@ -173,8 +200,13 @@ def build_hint_prompt(
 1.  **继续计划**: 如果章节意图尚未完成，请构思下一步的事件，并使用工具收集信息进行详细规划。规划完成后，使用`switch_writing_state_tool`切换到`开始提议`阶段。
 2.  **完成计划**: 如果你认为基于上面的事件列表，章节意图已经可以完整表达，无需再添加新的事件，请调用`switch_writing_state_tool`工具，将状态切换到`整合写作`阶段，以完成本章。
             """
-        case WritingState.PROPOSING_CHANGES:
-            return f"""章节标题: {chapter_info.title}
+
+
+def _proposing_hint(chapter_info: ChapterInfo, approved_events_str: str) -> str:
+    """
+    提议阶段的任务提示语
+    """
+    return f"""章节标题: {chapter_info.title}
 章节意图: {chapter_info.intent}
 
 当前处于小说写作的【提议阶段】。
@@ -183,10 +215,13 @@ def build_hint_prompt(
 
 在你认为提议完成之后，调用 `switch_writing_state_tool` 工具，将状态切换到 `审查` 阶段。
 """
-        case WritingState.REVIEW:
-            raise ValueError("REVIEW阶段不应该出现在llm节点")
-        case WritingState.FINAL_WRITING:
-            return f"""章节标题: {chapter_info.title}
+
+
+def _final_writing_hint(chapter_info: ChapterInfo, approved_events_str: str) -> str:
+    """
+    整合写作阶段的任务提示语
+    """
+    return f"""章节标题: {chapter_info.title}
 章节意图: {chapter_info.intent}
 
 当前处于小说写作的【整合写作阶段】。
@@ -201,11 +236,41 @@ def build_hint_prompt(
 请使用 `add_paragraph_tool` 工具，**可以多次调用**，分段落输出最终的章节内容。
 在完成整章的写作后，调用 `switch_writing_state_tool` 将状态切换到 `完成` 阶段。
             """
-        case WritingState.COMPLETE:
-            raise ValueError("COMPLETE阶段不应该出现在llm节点")
 
 
-def writer_bot(state: State):
+def _no_hint(chapter_info: ChapterInfo, approved_events_str: str) -> str:
+    """
+    不经过 llm 节点的阶段，不应该构建提示语
+    """
+    raise ValueError("审查和完成阶段不应该出现在llm节点")
+
+
+_HINT_BUILDERS: dict[WritingState, Callable[[ChapterInfo, str], str]] = {
+    WritingState.PLANNING: _planning_hint,
+    WritingState.PROPOSING_CHANGES: _proposing_hint,
+    WritingState.REVIEW: _no_hint,
+    WritingState.FINAL_WRITING: _final_writing_hint,
+    WritingState.COMPLETE: _no_hint,
+}
+"""
+各写作状态对应的提示语构建函数
+"""
+
+
+def build_hint_prompt(
+    state: State,
+) -> str:
+    """
+    构建并返回任务提示语
+    """
+    # 已在批准事件时增量拼接好，无需每轮重新拼接整个列表
+    approved_events_str = state.get("approved_events_str") or "无"
+    return _HINT_BUILDERS[state["writing_state"]](
+        state["current_chapter_info"], approved_events_str
+    )
+
+
+async def writer_bot(state: State):
     """
     llm节点
     """
@@ -215,7 +280,17 @@ def writer_bot(state: State):
     )
 
     messages = [*state["messages"], injected_message]
-    return {"messages": [injected_message, llm_with_tools.invoke(messages)]}
+    response = await llm_with_tools.ainvoke(messages)
+    update: dict[str, object] = {"messages": [injected_message, response]}
+    # 记下提议所在的位置，review_node 无需从后往前扫描整个会话历史
+    if (
+        isinstance(response, AIMessage)
+        and response.content  # pyright: ignore[reportUnknownMemberType]
+        and any(tc["name"] in WORLD_MODIFICATION_TOOLS for tc in response.tool_calls)
+    ):
+        # 追加在 injected_message 之后
+        update["last_proposal_index"] = len(state["messages"]) + 1
+    return update
 
 
 def review_node(
@@ -227,25 +302,13 @@ def review_node(
     # TODO: 实现更复杂的监督逻辑
 
     proposal_summary = "一项修改已通过审查。"
-    for msg in reversed(state["messages"]):
-        if isinstance(msg, AIMessage) and getattr(msg, "tool_calls", []):
-            tool_names = [tc["name"] for tc in msg.tool_calls]
-            is_world_modification = any(
-                tool_name
-                in [
-                    "add_entity_tool",
-                    "update_entity_property_tool",
-                    "add_relation_tool",
-                ]
-                for tool_name in tool_names
-            )
-
-            if is_world_modification and msg.content:  # pyright: ignore[reportUnknownMemberType]
-                if isinstance(msg.content, str):  # pyright: ignore[reportUnknownMemberType]
-                    proposal_summary = msg.content
-                else:
-                    raise ValueError("AIMessage content is not str")
-                break
+    proposal_index = state.get("last_proposal_index")
+    if proposal_index is not None:
+        content = state["messages"][proposal_index].content  # pyright: ignore[reportUnknownMemberType]
+        if isinstance(content, str):
+            proposal_summary = content
+        else:
+            raise ValueError("AIMessage content is not str")
 
     feedback_message = HumanMessage(
         content=f"系统审查通过了你的提议。事件“{proposal_summary}”已记录。现在请继续为推进章节意图进行下一步的计划。"
@@ -254,29 +317,38 @@ def review_node(
     return {
         "writing_state": WritingState.PLANNING,
         "approved_events": [proposal_summary],
+        "approved_events_str": proposal_summary,
         "messages": [feedback_message],
     }
 
 
-# MODIFIED: 这是本次修复的核心，重写了路由函数
+def complete_node(state: State):
+    """
+    完成节点，推进元数据中的写作章节索引
+    """
+    state["metadata"].writing_chapter_index += 1
+    return {}
+
+
+ROUTE_BY_STATE: dict[WritingState, str] = {
+    WritingState.COMPLETE: "complete",
+    WritingState.REVIEW: "review",
+}
+"""
+没有待执行的工具调用时，写作状态到下一个节点的映射，不在其中的状态回到 writer_bot
+"""
+
+
 def router_edge(state: State):
     """
     路由边，决定下一个要执行的节点。
     """
-    messages = state["messages"]
-    last_msg = messages[-1]
+    last_msg = state["messages"][-1]
 
-    if isinstance(last_msg, AIMessage) and getattr(last_msg, "tool_calls", []):
+    if isinstance(last_msg, AIMessage) and last_msg.tool_calls:
         return "tools"
 
-    match state["writing_state"]:
-        case WritingState.COMPLETE:
-            state["metadata"].writing_chapter_index += 1
-            return END
-        case WritingState.REVIEW:
-            return "review"
-        case _:
-            return "writer_bot"
+    return ROUTE_BY_STATE.get(state["writing_state"], "writer_bot")
 
 
 graph_builder.add_node("writer_bot", writer_bot)  # pyright: ignore[reportUnknownMemberType]
@@ -292,7 +364,12 @@ graph_builder.add_conditional_edges(
     # want to use a node named something else apart from "tools",
     # You can update the value of the dictionary to something else
     # e.g., "tools": "my_tools"
-    {"writer_bot": "writer_bot", "tools": "tools", "review": "review", END: END},
+    {
+        "writer_bot": "writer_bot",
+        "tools": "tools",
+        "review": "review",
+        "complete": "complete",
+    },
 )
 graph_builder.add_conditional_edges(
     "tools",
@@ -302,9 +379,16 @@ graph_builder.add_conditional_edges(
     # want to use a node named something else apart from "tools",
     # You can update the value of the dictionary to something else
     # e.g., "tools": "my_tools"
-    {"writer_bot": "writer_bot", "tools": "tools", "review": "review", END: END},
+    {
+        "writer_bot": "writer_bot",
+        "tools": "tools",
+        "review": "review",
+        "complete": "complete",
+    },
 )
 graph_builder.add_edge("review", "writer_bot")
+graph_builder.add_node("complete", complete_node)  # pyright: ignore[reportUnknownMemberType]
+graph_builder.add_edge("complete", END)
 
 
 graph = graph_builder.compile()  # pyright: ignore[reportUnknownMemberType]